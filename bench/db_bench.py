@@ -0,0 +1,120 @@
+"""Сравнение пропускной способности слоя БД: соединение на вызов и долгоживущее.
+
+«До» — прежний Database, открывавший и закрывавший sqlite3-соединение в
+каждом методе (журнал по умолчанию, synchronous=FULL). «После» — текущий
+Database с одним соединением на процесс, WAL и кэшем выражений.
+Нагрузка одинаковая: жизненный цикл сессии — пользователь, создание,
+присоединение, чтение сессии.
+
+    python bench/db_bench.py --sessions 2000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'movie_match_bot'))
+
+from database import Database  # noqa: E402
+
+# Операций с БД на одну сессию в нагрузке
+OPS_PER_SESSION = 5
+
+
+class ConnectPerCallDatabase:
+    """Прежняя реализация: новое соединение в каждом методе"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                user1_id INTEGER,
+                user2_id INTEGER,
+                user1_answers TEXT,
+                user2_answers TEXT,
+                status TEXT DEFAULT 'waiting',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def add_user(self, user_id, username, first_name):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT OR REPLACE INTO users (user_id, username, first_name)
+            VALUES (?, ?, ?)
+        ''', (user_id, username, first_name))
+        conn.commit()
+        conn.close()
+
+    def create_session(self, session_id, user1_id):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO sessions (session_id, user1_id, status)
+            VALUES (?, ?, 'waiting')
+        ''', (session_id, user1_id))
+        conn.commit()
+        conn.close()
+
+    def join_session(self, session_id, user2_id):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            UPDATE sessions
+            SET user2_id = ?, status = 'active'
+            WHERE session_id = ? AND status = 'waiting'
+        ''', (user2_id, session_id))
+        conn.commit()
+        conn.close()
+
+    def get_session(self, session_id):
+        conn = sqlite3.connect(self.db_path)
+        session = conn.execute('SELECT * FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        conn.close()
+        return session
+
+
+def run_workload(db, sessions):
+    started_at = time.perf_counter()
+    for number in range(sessions):
+        session_id = f'S{number:06d}'
+        db.add_user(2 * number, 'user', 'Первый')
+        db.add_user(2 * number + 1, 'user', 'Второй')
+        db.create_session(session_id, 2 * number)
+        db.join_session(session_id, 2 * number + 1)
+        db.get_session(session_id)
+    return sessions * OPS_PER_SESSION / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Операций с БД в секунду до и после")
+    parser.add_argument('--sessions', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        before = run_workload(ConnectPerCallDatabase(os.path.join(directory, 'before.db')), args.sessions)
+
+        db = Database(os.path.join(directory, 'after.db'))
+        after = run_workload(db, args.sessions)
+        db.close()
+
+    print(f"Соединение на вызов:      {before:10.0f} операций/с")
+    print(f"Долгоживущее соединение:  {after:10.0f} операций/с")
+    print(f"Ускорение: x{after / before:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Резервные рекомендации на каталоге, увеличенном до 10 тыс. фильмов и больше.
+
+«До» — прежний get_fallback_recommendations: каталог-словарь строится в
+каждом вызове, ключевые слова ищутся подстроками по списку жанров и
+настроений. «После» — текущий: каталог и индекс KEYWORD_INDEX строятся
+один раз, признаки ответов уже извлечены при заполнении анкеты.
+Для обоих путей печатаются задержка вызова и выделенная за вызов память
+(пик tracemalloc).
+
+    python bench/fallback_bench.py --films 10000
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'movie_match_bot'))
+# config.py требует токен бота, хотя бенчмарк к Telegram не обращается
+os.environ.setdefault('BOT_TOKEN', '123456:bench')
+
+import utils  # noqa: E402
+from features import empty_features, update_features  # noqa: E402
+
+ANSWERS = (
+    {"genre": "комедия, фантастика", "mood": "веселое"},
+    {"genre": "фантастика и драма", "mood": "веселое, расслабленное"},
+)
+
+OLD_GENRES = ["комедия", "драма", "фантастика", "боевик", "триллер",
+              "мелодрама", "детектив", "ужасы", "фэнтези", "приключения",
+              "аниме", "мультфильм", "биография", "история", "документальный"]
+OLD_MOODS = ["веселое", "романтическое", "грустное", "напряженное",
+             "расслабленное", "вдохновляющее", "страшное", "загадочное"]
+
+
+def scale_catalog(films):
+    """Каталог той же структуры, что FALLBACK_MOVIES, с films фильмами"""
+    originals = [(category, movie) for category, movies in utils.FALLBACK_MOVIES.items() for movie in movies]
+    catalog = {category: [] for category in utils.FALLBACK_MOVIES}
+    for number in range(films):
+        category, movie = originals[number % len(originals)]
+        movie = dict(movie, title=f"{movie['title']} #{number}")
+        catalog[category].append(movie)
+    return catalog
+
+
+def old_fallback(user1_answers, user2_answers, catalog):
+    """Прежний алгоритм; copy.deepcopy заменяет литерал каталога в теле функции"""
+    def extract_keywords(answer):
+        text = answer.lower()
+        keywords = [genre for genre in OLD_GENRES if genre in text]
+        keywords += [mood for mood in OLD_MOODS if mood in text]
+        return keywords if keywords else ["универсальный", "популярный"]
+
+    user1_keywords = extract_keywords(user1_answers.get('genre', '') + ' ' + user1_answers.get('mood', ''))
+    user2_keywords = extract_keywords(user2_answers.get('genre', '') + ' ' + user2_answers.get('mood', ''))
+    common_keywords = set(user1_keywords) & set(user2_keywords)
+    if not common_keywords:
+        common_keywords = {"комедия", "драма", "популярный"}
+
+    movie_database = copy.deepcopy(catalog)
+    selected_movies = []
+    for keyword in common_keywords:
+        if keyword in movie_database:
+            selected_movies.extend(movie_database[keyword])
+            if len(selected_movies) >= 6:
+                break
+    if len(selected_movies) < 4:
+        for movie in movie_database["популярный"]:
+            if movie not in selected_movies:
+                selected_movies.append(movie)
+
+    return "".join(f"{movie['title']} ({movie['year']})\n" for movie in selected_movies[:6])
+
+
+def features_of(answers):
+    features = empty_features()
+    for key in ("genre", "mood"):
+        features = update_features(features, key, answers[key])
+    return features
+
+
+def measure(func, calls):
+    """Средняя задержка (мс) и пик выделенной за вызов памяти (КБ)"""
+    func()
+    started_at = time.perf_counter()
+    for _ in range(calls):
+        func()
+    latency = (time.perf_counter() - started_at) / calls * 1000
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка и память резервных рекомендаций")
+    parser.add_argument('--films', type=int, default=10000)
+    parser.add_argument('--calls', type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = scale_catalog(args.films)
+    started_at = time.perf_counter()
+    utils.FALLBACK_MOVIES = catalog
+    utils.KEYWORD_INDEX = utils.build_keyword_index(catalog)
+    index_time = (time.perf_counter() - started_at) * 1000
+
+    features = (features_of(ANSWERS[0]), features_of(ANSWERS[1]))
+    before = measure(lambda: old_fallback(*ANSWERS, catalog), args.calls)
+    after = measure(lambda: utils.get_fallback_recommendations(*features), args.calls)
+
+    print(f"Фильмов в каталоге: {args.films}, индекс строится один раз за {index_time:.0f} мс")
+    print(f"До:    {before[0]:9.3f} мс/вызов, пик памяти {before[1]:9.1f} КБ")
+    print(f"После: {after[0]:9.3f} мс/вызов, пик памяти {after[1]:9.1f} КБ")
+
+
+if __name__ == '__main__':
+    main()
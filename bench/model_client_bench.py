@@ -0,0 +1,70 @@
+"""Накладные расходы на клиент Gemini в каждом запросе.
+
+«До» — как прежний generate_movie_recommendations: словари настроек и
+genai.GenerativeModel создаются заново при каждом запросе. «После» —
+get_model() из utils, возвращающий клиент из реестра. Сеть не
+используется: измеряется только подготовка клиента перед вызовом API.
+
+    python bench/model_client_bench.py --calls 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'movie_match_bot'))
+# config.py требует токен бота, хотя бенчмарк к Telegram не обращается;
+# имя модели нужно только для создания клиента
+os.environ.setdefault('BOT_TOKEN', '123456:bench')
+os.environ.setdefault('GEMINI_MODEL', 'gemini-1.5-flash')
+
+import google.generativeai as genai  # noqa: E402
+
+from config import GEMINI_MODEL, GEMINI_TEMPERATURE, GEMINI_MAX_TOKENS  # noqa: E402
+from utils import get_model  # noqa: E402
+
+
+def build_model_per_call():
+    """Прежний путь: настройки и клиент собираются в каждом запросе"""
+    generation_config = {
+        "temperature": GEMINI_TEMPERATURE,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": GEMINI_MAX_TOKENS,
+    }
+    safety_settings = [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    ]
+    return genai.GenerativeModel(
+        model_name=GEMINI_MODEL,
+        generation_config=generation_config,
+        safety_settings=safety_settings
+    )
+
+
+def measure(func, calls):
+    started_at = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started_at) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость подготовки клиента Gemini на запрос")
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    get_model()  # клиент из реестра создается один раз, при запуске бота
+    before = measure(build_model_per_call, args.calls)
+    after = measure(get_model, args.calls)
+
+    print(f"Клиент на каждый запрос: {before:8.2f} мкс/вызов")
+    print(f"Клиент из реестра:       {after:8.2f} мкс/вызов")
+    print(f"Ускорение: x{before / after:.0f}")
+
+
+if __name__ == '__main__':
+    main()
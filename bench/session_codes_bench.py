@@ -0,0 +1,70 @@
+"""Выдача миллионов кодов сессий двумя аллокаторами над одной БД.
+
+Коды сохраняются в sessions как завершенные сессии: первичный ключ
+session_id сразу дал бы IntegrityError на любом повторе.
+
+    python bench/session_codes_bench.py --codes 2000000
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'movie_match_bot'))
+
+from database import AsyncDatabase, Database  # noqa: E402
+from session_codes import SessionCodeAllocator  # noqa: E402
+
+CODE_FORMAT = re.compile(r'^[A-Z0-9]{6}$')
+
+
+async def run(path, total, batch_size, block_size):
+    database = Database(path)
+    db = AsyncDatabase(database)
+    await db.start()
+    allocators = [SessionCodeAllocator(db.reserve_session_numbers, block_size=block_size) for _ in range(2)]
+
+    allocated = 0
+    allocate_time = 0.0
+    while allocated < total:
+        started_at = time.perf_counter()
+        rows = []
+        for number in range(min(batch_size, total - allocated)):
+            code = await allocators[number % 2].allocate()
+            rows.append((code, number))
+        allocate_time += time.perf_counter() - started_at
+
+        assert all(CODE_FORMAT.match(code) for code, _ in rows)
+        with database.batch():
+            database.conn.executemany(
+                "INSERT INTO sessions (session_id, user1_id, status) VALUES (?, ?, 'completed')", rows
+            )
+        allocated += len(rows)
+
+    count = database.conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+    await db.close()
+    return count, allocate_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Кодов сессий в секунду без конфликтов в БД")
+    parser.add_argument('--codes', type=int, default=2_000_000)
+    parser.add_argument('--batch', type=int, default=50_000)
+    parser.add_argument('--block-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        count, allocate_time = asyncio.run(
+            run(os.path.join(directory, 'codes.db'), args.codes, args.batch, args.block_size)
+        )
+
+    assert count == args.codes, "повтор кода"
+    print(f"Кодов: {count}, без повторов")
+    print(f"Выдача: {count / allocate_time:10.0f} кодов/с")
+
+
+if __name__ == '__main__':
+    main()
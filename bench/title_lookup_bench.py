@@ -0,0 +1,92 @@
+"""Поиск любимых фильмов по названию в индексе на 100 тыс. фильмов.
+
+Каталог синтетический: названия вида «Русское / Original» из случайных
+слов. Запросы — точные названия (словарь exact) и названия с опечаткой
+(триграммы). Для сравнения приведен линейный перебор всех названий с тем
+же коэффициентом Жаккара — так пришлось бы искать без индекса.
+
+    python bench/title_lookup_bench.py --films 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'movie_match_bot'))
+
+from title_index import TitleIndex, normalize_title, trigrams  # noqa: E402
+
+RUSSIAN_SYLLABLES = ["ма", "три", "ца", "ноч", "ной", "го", "род", "звез", "да", "ле", "то", "мо", "ре",
+                     "пу", "ть", "до", "мой", "ко", "рот", "кий", "сон", "вой", "на", "мир"]
+ENGLISH_SYLLABLES = ["star", "night", "ma", "trix", "ci", "ty", "sum", "mer", "sea", "road", "home",
+                     "dream", "war", "light", "dark", "lo", "ve", "king", "dom", "fall"]
+
+
+def make_word(rng, syllables):
+    return ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def make_titles(films, rng):
+    titles = []
+    for number in range(films):
+        russian = ' '.join(make_word(rng, RUSSIAN_SYLLABLES) for _ in range(rng.randint(1, 3)))
+        english = ' '.join(make_word(rng, ENGLISH_SYLLABLES) for _ in range(rng.randint(1, 3)))
+        titles.append(f"{russian.capitalize()} {number % 7 or ''} / {english.title()}".replace('  ', ' '))
+    return titles
+
+
+def with_typo(title, rng):
+    position = rng.randrange(1, len(title) - 1)
+    return title[:position] + title[position + 1:]
+
+
+def linear_lookup(entries, title, min_similarity=0.45):
+    """Перебор всех названий без индекса"""
+    grams = trigrams(normalize_title(title))
+    best, best_similarity = None, min_similarity
+    for movie_id, entry_grams in entries:
+        common = len(grams & entry_grams)
+        similarity = common / (len(grams) + len(entry_grams) - common)
+        if similarity >= best_similarity:
+            best, best_similarity = movie_id, similarity
+    return best
+
+
+def rate(func, queries):
+    started_at = time.perf_counter()
+    for query in queries:
+        func(query)
+    return len(queries) / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поисков названий в секунду")
+    parser.add_argument('--films', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--linear-queries', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    titles = make_titles(args.films, rng)
+
+    started_at = time.perf_counter()
+    index = TitleIndex(titles)
+    build_time = time.perf_counter() - started_at
+
+    samples = [rng.choice(titles).split('/')[rng.randint(0, 1)].strip() for _ in range(args.queries)]
+    exact_queries = samples
+    fuzzy_queries = [with_typo(title, rng) for title in samples]
+
+    entries = [(movie_id, trigrams(normalize_title(name)))
+               for movie_id, title in enumerate(titles) for name in title.split('/')]
+
+    print(f"Фильмов: {args.films}, индекс строится за {build_time:.2f} с")
+    print(f"Точное название:        {rate(index.lookup, exact_queries):10.0f} поисков/с")
+    print(f"Название с опечаткой:   {rate(index.lookup, fuzzy_queries):10.0f} поисков/с")
+    print(f"Перебор без индекса:    "
+          f"{rate(lambda query: linear_lookup(entries, query), fuzzy_queries[:args.linear_queries]):10.1f} поисков/с")
+
+
+if __name__ == '__main__':
+    main()
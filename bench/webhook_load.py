@@ -0,0 +1,131 @@
+"""Нагрузочный генератор для режима вебхука.
+
+Поднимает заглушку Bot API, отправляет на вебхук бота обновления от многих
+пользователей и считает, сколько ответов бот успел отправить в секунду.
+
+Запуск бота против заглушки (лимиты отправки поднимаем, чтобы мерить
+обработку, а не планировщик):
+
+    cd movie_match_bot
+    BOT_TOKEN=123456:bench TELEGRAM_API_URL=http://127.0.0.1:8090 \\
+    BOT_MODE=webhook WEBHOOK_WORKERS=4 WEBHOOK_PORT=8080 \\
+    SEND_GLOBAL_RATE=100000 SEND_CHAT_RATE=1000 SEND_CHAT_BURST=1000 \\
+    FSM_STORAGE=sqlite DB_PATH=/tmp/bench.db python bot.py
+
+Затем в другом терминале:
+
+    python bench/webhook_load.py --updates 5000 --users 500
+
+Сравните результат с WEBHOOK_WORKERS=1: на машине с несколькими ядрами
+пропускная способность растет с числом рабочих процессов.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+from aiohttp import web
+
+# Кнопка «Помощь»: одно обновление — ровно один ответ бота, без состояния
+HELP_TEXT = "ℹ️ Помощь"
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отвечает на все методы и считает отправленные сообщения"""
+
+    def __init__(self):
+        self.sent = 0
+        self.message_ids = itertools.count(1)
+        self.done = asyncio.Event()
+        self.expected = None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        data = await request.post()
+        if method != 'sendMessage':
+            return web.json_response({'ok': True, 'result': True})
+
+        self.sent += 1
+        if self.expected is not None and self.sent >= self.expected:
+            self.done.set()
+        chat_id = int(data.get('chat_id', 0))
+        return web.json_response({'ok': True, 'result': {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': data.get('text', ''),
+        }})
+
+
+def make_update(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': HELP_TEXT,
+        },
+    }
+
+
+async def send_updates(url, secret, updates, users, concurrency):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    queue = asyncio.Queue()
+    for update_id in range(1, updates + 1):
+        queue.put_nowait(make_update(update_id, 1000 + update_id % users))
+    errors = 0
+
+    async def worker(session):
+        nonlocal errors
+        while not queue.empty():
+            update = queue.get_nowait()
+            async with session.post(url, json=update, headers=headers) as response:
+                if response.status != 200:
+                    errors += 1
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на вебхук бота")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook', help="адрес вебхука бота")
+    parser.add_argument('--secret', default=None, help="WEBHOOK_SECRET бота")
+    parser.add_argument('--api-port', type=int, default=8090,
+                        help="порт заглушки Bot API, вне портов рабочих процессов")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+
+    api.expected = args.updates
+    started_at = time.monotonic()
+    errors = await send_updates(args.url, args.secret, args.updates, args.users, args.concurrency)
+    accepted_at = time.monotonic()
+    try:
+        await asyncio.wait_for(api.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    finished_at = time.monotonic()
+    await runner.cleanup()
+
+    print(f"Отправлено обновлений: {args.updates} (ошибок вебхука: {errors})")
+    print(f"Приняты вебхуком за {accepted_at - started_at:.2f} с")
+    print(f"Ответов бота: {api.sent} за {finished_at - started_at:.2f} с "
+          f"({api.sent / (finished_at - started_at):.0f} в секунду)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,12 @@
 import asyncio
 import logging
-import random
-import string
 import sqlite3
+import time
 from aiogram import Bot, Dispatcher, Router, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from aiogram.filters import Command
 from aiogram.fsm.storage.base import StorageKey
 from aiogram.types import (
@@ -13,26 +16,146 @@ from aiogram.types import (
     KeyboardButton
 )
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
 from aiogram.fsm.state import State, StatesGroup
 
-from config import BOT_TOKEN
-from database import Database
-from utils import generate_movie_recommendations
+from config import (
+    BOT_TOKEN,
+    DB_PATH,
+    ADMIN_IDS,
+    SESSION_TTL_SECONDS,
+    EXPIRY_SWEEP_INTERVAL,
+    EXPIRY_BATCH_SIZE,
+    FSM_STORAGE,
+    FSM_FLUSH_INTERVAL,
+    FSM_CACHE_SIZE,
+    STATE_IDLE_TTL,
+    STATE_EVICTION_INTERVAL,
+    STATE_TRACKER_MAX_KEYS,
+    RECOMMENDATION_CACHE_SIZE,
+    RECOMMENDATION_CACHE_TTL,
+    GEMINI_STREAMING,
+    STREAM_EDIT_INTERVAL,
+    GEMINI_SOFT_DEADLINE,
+    GEMINI_HARD_DEADLINE,
+    SPECULATIVE_GENERATION,
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_MAX_RETRIES,
+    TELEGRAM_API_URL,
+    DELIVERY_MAX_RETRIES,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+    WEBHOOK_WORKER_INDEX,
+    GENERATION_WORKERS,
+    GENERATION_JOB_LEASE,
+    GENERATION_JOB_MAX_ATTEMPTS
+)
+from database import Database, AsyncDatabase
+from storage import SQLiteStorage, ActivityTracker, parse_key
+from session_codes import SessionCodeAllocator
+from recommendation_cache import RecommendationCache
+from speculation import SpeculativeGenerator
+from features import empty_features, update_features
+from llm_dispatcher import PRIORITY_BACKGROUND
+from sender import SendScheduler, send_priority, PRIORITY_BULK
+from delivery import MessageDelivery, fan_out
+from webhook import create_router_app, start_workers, stop_workers, worker_port
+from jobs import GenerationQueue
+from utils import (
+    generate_movie_recommendations,
+    render_fallback_recommendations,
+    build_prompt,
+    resolve_favorites,
+    RECOMMENDATIONS_PARSE_MODE,
+    warm_up_models,
+    load_local_recommender,
+    build_title_index,
+    llm_dispatcher
+)
+import metrics
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Инициализация базы данных
+db = AsyncDatabase(Database(DB_PATH))
+
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+
+# Все исходящие запросы с chat_id идут через планировщик с лимитами Telegram;
+# рабочие процессы вебхука делят общий лимит поровну
+sender = SendScheduler(
+    global_rate=SEND_GLOBAL_RATE if WEBHOOK_WORKER_INDEX is None else SEND_GLOBAL_RATE / WEBHOOK_WORKERS,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES
+)
+bot.session.middleware(sender)
+if WEBHOOK_WORKER_INDEX is not None:
+    # Несколько процессов: состояние партнера меняет процесс другого
+    # пользователя, поэтому пишем сразу в общую БД и не кэшируем чтения
+    storage = SQLiteStorage(db, flush_interval=0, cache_size=0)
+elif FSM_STORAGE == 'sqlite':
+    storage = SQLiteStorage(db, flush_interval=FSM_FLUSH_INTERVAL, cache_size=FSM_CACHE_SIZE)
+else:
+    storage = MemoryStorage()
+# Обновления одного пользователя обрабатываются по очереди: иначе два быстрых
+# ответа одновременно читают и перезаписывают данные анкеты, и один теряется
+dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
 router = Router()
 dp.include_router(router)
 
-# Инициализация базы данных
-db = Database()
+# Кэш рекомендаций для одинаковых пар ответов
+recommendation_cache = RecommendationCache(
+    db,
+    max_size=RECOMMENDATION_CACHE_SIZE,
+    ttl=RECOMMENDATION_CACHE_TTL
+)
+
+async def generate_speculatively(user1_answers: dict, user2_answers: dict):
+    """Фоновая генерация по неполным ответам, с низким приоритетом"""
+    return await generate_movie_recommendations(
+        user1_answers,
+        user2_answers,
+        cache=recommendation_cache,
+        use_fallback=False,
+        priority=PRIORITY_BACKGROUND
+    )
+
+
+# Спекулятивная генерация до ответа на последний вопрос
+speculation = SpeculativeGenerator(generate_speculatively, build_prompt) if SPECULATIVE_GENERATION else None
+
+# Коды сессий из общего счетчика в БД
+session_codes = SessionCodeAllocator(db.reserve_session_numbers)
+
+def owns_user(user_id: int):
+    """Обновления пользователя обрабатывает этот процесс"""
+    return WEBHOOK_WORKER_INDEX is None or user_id % WEBHOOK_WORKERS == WEBHOOK_WORKER_INDEX
+
+
+# Последняя активность своих пользователей для вытеснения брошенных анкет
+activity = ActivityTracker(max_keys=STATE_TRACKER_MAX_KEYS, owns=owns_user)
+
+
+@dp.message.outer_middleware()
+async def track_activity(handler, event, data):
+    """Отмечаем активность пользователя перед обработкой сообщения"""
+    metrics.inc('messages_received')
+    state = data.get('state')
+    if state is not None:
+        activity.touch(state.key)
+    return await handler(event, data)
 
 
 # Определяем состояния
@@ -42,12 +165,9 @@ class UserStates(StatesGroup):
 
 
 class QuestionStates(StatesGroup):
-    genre = State()
-    favorite_movies = State()
-    mood = State()
-    duration = State()
-    year = State()
-    additional = State()
+    # Номер текущего вопроса хранится в данных (current_question),
+    # поэтому ответ не требует отдельной записи состояния
+    answering = State()
 
 
 # Вопросы для опроса
@@ -63,6 +183,8 @@ QUESTIONS = [
      "Есть ли дополнительные пожелания?\n(например: без ужасов, хочу что-то легкое, интересные диалоги)")
 ]
 
+SKIP_BUTTON = "⏭️ Пропустить"
+
 
 # REPLY-КЛАВИАТУРЫ (кнопки под строкой ввода)
 
@@ -105,31 +227,28 @@ def get_skip_keyboard():
     """Клавиатура для пропуска вопроса"""
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="⏭️ Пропустить")]
+            [KeyboardButton(text=SKIP_BUTTON)]
         ],
         resize_keyboard=True,
         one_time_keyboard=False
     )
 
 
-def generate_session_code():
-    """Генерация 6-значного кода сессии"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-
 async def start_questions_for_user(user_id: int, session_code: str, username: str = None):
     """Запуск вопросов для пользователя"""
     from aiogram.fsm.storage.base import StorageKey
     storage_key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
     user_state = FSMContext(storage=storage, key=storage_key)
+    activity.touch(storage_key)
 
-    await user_state.set_state(QuestionStates.genre)
-    await user_state.update_data(
-        session_code=session_code,
-        current_question=0,
-        answers={},
-        partner_username=username
-    )
+    await user_state.set_state(QuestionStates.answering)
+    await user_state.set_data({
+        'session_code': session_code,
+        'current_question': 0,
+        'answers': {},
+        'features': empty_features(),
+        'partner_username': username
+    })
 
     # Отправляем первый вопрос
     question_num = 1
@@ -147,12 +266,26 @@ async def start_questions_for_user(user_id: int, session_code: str, username: st
     )
 
 
-async def ask_next_question(user_id: int, state: FSMContext):
-    """Задать следующий вопрос"""
-    data = await state.get_data()
+def store_answer(data: dict, question_key: str, text: str):
+    """Сохранение ответа в данных анкеты вместе с признаками, извлеченными из него сразу"""
+    data.setdefault('answers', {})[question_key] = text
+    data['features'] = update_features(data.get('features'), question_key, text, resolve_favorites)
+
+
+async def ask_next_question(user_id: int, state: FSMContext, data: dict):
+    """Задать следующий вопрос.
+
+    data — уже прочитанные и измененные данные анкеты; они записываются
+    в хранилище одним set_data, без повторного чтения.
+    """
     current_question = data.get('current_question', 0)
     session_code = data.get('session_code')
 
+    # Счетчик увеличивается и после последнего вопроса: так повторные
+    # сообщения не сохраняют ответы второй раз
+    data['current_question'] = current_question + 1
+    await state.set_data(data)
+
     if current_question < len(QUESTIONS):
         question_key, question_text = QUESTIONS[current_question]
 
@@ -164,13 +297,16 @@ async def ask_next_question(user_id: int, state: FSMContext):
             reply_markup=get_skip_keyboard()
         )
 
-        # Обновляем счетчик
-        await state.update_data(current_question=current_question + 1)
+        # Остался последний вопрос: можно начать генерацию заранее
+        if speculation is not None and current_question == len(QUESTIONS) - 1:
+            session = await db.get_session(session_code)
+            if session and session[2]:
+                speculation.offer(session_code, user_id, data.get('answers', {}), (session[1], session[2]))
         return True
     else:
         # Все вопросы отвечены
         answers = data.get('answers', {})
-        db.save_user_answers(session_code, user_id, answers)
+        await db.save_user_answers(session_code, user_id, answers, data.get('features'))
 
         await bot.send_message(
             user_id,
@@ -178,32 +314,80 @@ async def ask_next_question(user_id: int, state: FSMContext):
             reply_markup=ReplyKeyboardRemove()
         )
 
-        # Проверяем, ответил ли партнер
-        user1_answers, user2_answers = db.get_both_answers(session_code)
-
-        if user1_answers and user2_answers:
-            await generate_and_send_recommendations(session_code, user1_answers, user2_answers)
-            db.complete_session(session_code)
-
-            # Очищаем состояния
-            session = db.get_session(session_code)
-            if session:
-                for uid in [session[1], session[2]]:
-                    if uid:
-                        storage_key = StorageKey(bot_id=bot.id, chat_id=uid, user_id=uid)
-                        user_state = FSMContext(storage=storage, key=storage_key)
-                        await user_state.clear()
-
-                        # Отправляем главное меню
-                        await bot.send_message(
-                            uid,
-                            "🎬 Хотите подобрать еще фильмы?",
-                            reply_markup=get_main_keyboard()
-                        )
+        # Проверяем, ответил ли партнер. Задание генерации ставит только тот,
+        # кто первым атомарно перевел сессию в статус 'generating'; саму
+        # генерацию выполняет очередь, поэтому обработчик не ждет Gemini
+        if await db.claim_completion(session_code, time.time()):
+            metrics.inc('generation_jobs_enqueued')
+            generation_queue.notify()
 
         return False
 
 
+async def run_generation_job(session_code: str):
+    """Задание очереди генерации: рекомендации, завершение сессии, сброс анкет.
+
+    При повторе после сбоя уже завершенная сессия не генерируется заново.
+    """
+    session = await db.get_session(session_code)
+    if not session:
+        return
+
+    if session[5] != 'completed':
+        user1_answers, user2_answers, user1_features, user2_features = \
+            await db.get_both_answers(session_code, with_features=True)
+        await generate_and_send_recommendations(
+            session_code,
+            user1_answers,
+            user2_answers,
+            features=(user1_features, user2_features)
+        )
+        await db.complete_session(session_code)
+        # Очищаем состояния и отправляем главное меню
+        await reset_users([session[1], session[2]], "🎬 Хотите подобрать еще фильмы?")
+    else:
+        await reset_users([session[1], session[2]])
+
+
+async def fail_generation_job(session_code: str):
+    """Генерация не удалась после всех попыток: сессия уже помечена 'failed',
+    освобождаем анкеты и сообщаем обоим пользователям"""
+    session = await db.get_session(session_code)
+    if session:
+        await reset_users(
+            [session[1], session[2]],
+            "😔 Не удалось подобрать фильмы для вашей сессии.\n\n"
+            "Создайте новую сессию и попробуйте еще раз!"
+        )
+
+
+async def reset_users(user_ids: list, text: str = None):
+    """Очистка состояний пользователей и, если задан text, сообщение с главным меню"""
+    for uid in user_ids:
+        if not uid:
+            continue
+        storage_key = StorageKey(bot_id=bot.id, chat_id=uid, user_id=uid)
+        user_state = FSMContext(storage=storage, key=storage_key)
+        await user_state.clear()
+
+        if text:
+            try:
+                await bot.send_message(uid, text, reply_markup=get_main_keyboard())
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение в чат {uid}: {e}")
+
+
+# Очередь генерации рекомендаций с исполнителями в этом процессе
+generation_queue = GenerationQueue(
+    db,
+    run_generation_job,
+    workers=GENERATION_WORKERS,
+    lease_seconds=GENERATION_JOB_LEASE,
+    max_attempts=GENERATION_JOB_MAX_ATTEMPTS,
+    on_failure=fail_generation_job
+)
+
+
 # ОБРАБОТЧИКИ КОМАНД И СООБЩЕНИЙ
 
 @router.message(Command("start"))
@@ -213,7 +397,7 @@ async def cmd_start(message: Message):
     username = message.from_user.username
     first_name = message.from_user.first_name
 
-    db.add_user(user_id, username, first_name)
+    await db.add_user(user_id, username, first_name)
 
     await message.answer(
         f"👋 Привет, {first_name}!\n\n"
@@ -224,6 +408,15 @@ async def cmd_start(message: Message):
     )
 
 
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """Метрики бота для администраторов"""
+    if message.from_user.username not in ADMIN_IDS:
+        return
+
+    await message.answer(metrics.format_report())
+
+
 @router.message(F.text == "ℹ️ Помощь")
 @router.message(Command("help"))
 async def cmd_help(message: Message):
@@ -263,14 +456,9 @@ async def cmd_help(message: Message):
 async def create_session(message: Message, state: FSMContext):
     """Создание новой сессии"""
     user_id = message.from_user.id
-    session_code = generate_session_code()
 
     # Проверяем, нет ли активной сессии
-    conn = sqlite3.connect('movies.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT session_id FROM sessions WHERE user1_id = ? AND status != "completed"', (user_id,))
-    active_session = cursor.fetchone()
-    conn.close()
+    active_session = await db.get_active_session_by_creator(user_id)
 
     if active_session:
         await message.answer(
@@ -281,8 +469,22 @@ async def create_session(message: Message, state: FSMContext):
         )
         return
 
-    # Создаем сессию
-    db.create_session(session_code, user_id)
+    # Создаем сессию. Коды из счетчика не повторяются; конфликт по первичному
+    # ключу возможен только со случайным кодом, выданным до перехода на
+    # счетчик, и тогда берем следующий код
+    for _ in range(3):
+        session_code = await session_codes.allocate()
+        try:
+            await db.create_session(session_code, user_id)
+            break
+        except sqlite3.IntegrityError:
+            continue
+    else:
+        await message.answer(
+            "⚠️ Не удалось создать сессию. Попробуйте еще раз.",
+            reply_markup=get_main_keyboard()
+        )
+        return
 
     await state.set_state(UserStates.waiting_for_partner)
     await state.update_data(session_code=session_code)
@@ -298,9 +500,6 @@ async def create_session(message: Message, state: FSMContext):
         reply_markup=get_cancel_keyboard()
     )
 
-    # Запускаем таймер для удаления просроченной сессии
-    asyncio.create_task(delete_expired_session(session_code))
-
 
 @router.message(F.text == "🔗 Присоединиться")
 async def join_session_prompt(message: Message, state: FSMContext):
@@ -325,11 +524,7 @@ async def cancel_operation(message: Message, state: FSMContext):
 
     if current_state == UserStates.waiting_for_partner and session_code:
         # Удаляем сессию из БД
-        conn = sqlite3.connect('movies.db')
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_code,))
-        conn.commit()
-        conn.close()
+        await db.delete_session(session_code)
 
         await message.answer(
             "❌ Сессия отменена.\n\n"
@@ -365,28 +560,8 @@ async def show_my_sessions(message: Message):
     """Показать активные сессии пользователя"""
     user_id = message.from_user.id
 
-    conn = sqlite3.connect('movies.db')
-    cursor = conn.cursor()
-
-    # Сессии, где пользователь создатель
-    cursor.execute('''
-        SELECT session_id, status, user2_id, created_at 
-        FROM sessions 
-        WHERE user1_id = ? AND status != "completed"
-    ''', (user_id,))
-
-    creator_sessions = cursor.fetchall()
-
-    # Сессии, где пользователь участник
-    cursor.execute('''
-        SELECT session_id, status, user1_id, created_at 
-        FROM sessions 
-        WHERE user2_id = ? AND status != "completed"
-    ''', (user_id,))
-
-    participant_sessions = cursor.fetchall()
-
-    conn.close()
+    # Сессии, где пользователь создатель и где участник
+    creator_sessions, participant_sessions = await db.get_user_sessions(user_id)
 
     response = "📊 !! Ваши активные сессии !!\n\n"
 
@@ -412,29 +587,6 @@ async def show_my_sessions(message: Message):
     await message.answer(response, reply_markup=get_main_keyboard())
 
 
-@router.message(F.text == "⏭️ Пропустить")
-async def skip_question(message: Message, state: FSMContext):
-    """Пропуск текущего вопроса"""
-    current_state = await state.get_state()
-
-    if current_state and "QuestionStates" in str(current_state):
-        data = await state.get_data()
-        current_question_idx = data.get('current_question', 1) - 1
-        answers = data.get('answers', {})
-
-        if current_question_idx < len(QUESTIONS):
-            question_key, _ = QUESTIONS[current_question_idx]
-            answers[question_key] = "не указано"
-            await state.update_data(answers=answers)
-
-            await message.answer(
-                f"⏭️ Вопрос пропущен.",
-                reply_markup=get_skip_keyboard()
-            )
-
-            await ask_next_question(message.from_user.id, state)
-
-
 @router.message(UserStates.entering_code)
 async def process_session_code(message: Message, state: FSMContext):
     """Обработка введенного кода сессии"""
@@ -452,7 +604,7 @@ async def process_session_code(message: Message, state: FSMContext):
         return
 
     # Проверяем существование сессии
-    session = db.get_session(session_code)
+    session = await db.get_session(session_code)
 
     if not session:
         await message.answer(
@@ -483,8 +635,8 @@ async def process_session_code(message: Message, state: FSMContext):
 
     # Присоединяем пользователя к сессии
     user2_id = message.from_user.id
-    db.join_session(session_code, user2_id)
-    db.add_user(user2_id, message.from_user.username, message.from_user.first_name)
+    await db.join_session(session_code, user2_id)
+    await db.add_user(user2_id, message.from_user.username, message.from_user.first_name)
 
     # ЗАПУСКАЕМ ОПРОС ДЛЯ ОБОИХ ПОЛЬЗОВАТЕЛЕЙ
 
@@ -505,157 +657,303 @@ async def process_session_code(message: Message, state: FSMContext):
     )
 
 
-# Обработчики ответов на вопросы
-@router.message(QuestionStates.genre)
-async def process_genre(message: Message, state: FSMContext):
-    """Обработка ответа на вопрос о жанрах"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
-        return
-
+# Обработчик ответов на вопросы анкеты
+@router.message(QuestionStates.answering, F.text)
+async def process_answer(message: Message, state: FSMContext):
+    """Ответ на текущий вопрос QUESTIONS: одно чтение и одна запись данных FSM"""
     data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['genre'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
-
+    asked = data.get('current_question', 0)
 
-@router.message(QuestionStates.favorite_movies)
-async def process_favorite_movies(message: Message, state: FSMContext):
-    """Обработка ответа на вопрос о любимых фильмах"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
+    if asked > len(QUESTIONS):
+        # Анкета уже заполнена, ждем партнера
+        await message.answer("⏳ Ваши ответы уже сохранены. Ждем ответы второго пользователя...")
         return
 
-    data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['favorite_movies'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
+    # До первого вопроса ждем любое сообщение о готовности, его не сохраняем
+    if asked > 0:
+        question_key, _ = QUESTIONS[asked - 1]
+        if message.text == SKIP_BUTTON:
+            store_answer(data, question_key, "не указано")
+            await message.answer(
+                f"⏭️ Вопрос пропущен.",
+                reply_markup=get_skip_keyboard()
+            )
+        else:
+            store_answer(data, question_key, message.text)
 
+    await ask_next_question(message.from_user.id, state, data)
 
-@router.message(QuestionStates.mood)
-async def process_mood(message: Message, state: FSMContext):
-    """Обработка ответа на вопрос о настроении"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
-        return
 
-    data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['mood'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
+class ProgressiveEdits:
+    """Показ частичного ответа правкой уже отправленных сообщений.
 
+    update() только запоминает последний текст; фоновая задача правит
+    сообщения не чаще раза в interval секунд и лишь при изменении текста.
+    Частичный текст в режиме Markdown отправляется без разметки, так как
+    незавершенная разметка не проходит проверку Telegram; HTML в
+    структурном режиме строится только из полностью полученных фильмов.
+    """
 
-@router.message(QuestionStates.duration)
-async def process_duration(message: Message, state: FSMContext):
-    """Обработка ответа на вопрос о длительности"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
-        return
+    # Лимит длины текста сообщения Telegram
+    MAX_LENGTH = 4096
+
+    def __init__(self, messages, interval, parse_mode=None):
+        self.messages = messages
+        self.interval = interval
+        self.parse_mode = parse_mode
+        self.text = None
+        self.shown_text = None
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def update(self, text):
+        self.text = text
+        self.changed.set()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+
+            if len(self.text) > self.MAX_LENGTH - 2:
+                # Обрезка могла бы разорвать HTML-теги; ждем финальный текст
+                if self.parse_mode:
+                    continue
+                text = self.text[:self.MAX_LENGTH - 2] + " ⏳"
+            else:
+                text = self.text + " ⏳"
+
+            if text != self.shown_text:
+                self.shown_text = text
+                for chat_id, message_id in self.messages:
+                    try:
+                        await bot.edit_message_text(
+                            text,
+                            chat_id=chat_id,
+                            message_id=message_id,
+                            parse_mode=self.parse_mode
+                        )
+                    except Exception as e:
+                        logger.debug(f"Не удалось обновить сообщение: {e}")
 
-    data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['duration'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
+            await asyncio.sleep(self.interval)
 
 
-@router.message(QuestionStates.year)
-async def process_year(message: Message, state: FSMContext):
-    """Обработка ответа на вопрос о годе выпуска"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
+async def generate_and_send_recommendations(session_code: str, user1_answers: dict, user2_answers: dict,
+                                            features: tuple = None):
+    """Генерация и отправка рекомендаций"""
+    session = await db.get_session(session_code)
+    if not session:
         return
 
-    data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['year'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
+    user1_id, user2_id = session[1], session[2]
 
+    # Генерация стартует сразу, не дожидаясь отправки заглушек: под лимитом
+    # отправки в чат они могут уйти лишь через несколько секунд
+    progress = None
+    if GEMINI_STREAMING:
+        progress = ProgressiveEdits(
+            [],
+            interval=STREAM_EDIT_INTERVAL,
+            parse_mode='HTML' if RECOMMENDATIONS_PARSE_MODE == 'HTML' else None
+        )
 
-@router.message(QuestionStates.additional)
-async def process_additional(message: Message, state: FSMContext):
-    """Обработка ответа на дополнительный вопрос"""
-    if message.text == "⏭️ Пропустить":
-        await skip_question(message, state)
+    started_at = time.monotonic()
+    generation = None
+    if speculation is not None:
+        generation = speculation.take(session_code, user1_answers, user2_answers)
+    if generation is None:
+        generation = asyncio.create_task(generate_movie_recommendations(
+            user1_answers,
+            user2_answers,
+            cache=recommendation_cache,
+            on_partial=progress.update if progress else None,
+            use_fallback=False,
+            features=features
+        ))
+
+    # Заглушки обоим пользователям одновременно; рекомендации потом заменят их.
+    # Частичный текст, накопленный за это время, покажется первой правкой
+    deliveries = await asyncio.gather(send_placeholder(user1_id), send_placeholder(user2_id))
+    if progress:
+        progress.messages = [(delivery.chat_id, delivery.message_ids[0]) for delivery in deliveries if delivery.message_ids]
+        progress.start()
+
+    # Ждем Gemini до мягкого дедлайна
+    try:
+        remaining = GEMINI_SOFT_DEADLINE - (time.monotonic() - started_at)
+        recommendations = await asyncio.wait_for(asyncio.shield(generation), max(remaining, 0))
+    except asyncio.TimeoutError:
+        recommendations = None
+        metrics.inc('generation_soft_timeouts')
+    finally:
+        if progress:
+            await progress.stop()
+
+    if recommendations:
+        metrics.observe('generation_time', time.monotonic() - started_at)
+        await send_recommendations(deliveries, recommendations)
         return
 
-    data = await state.get_data()
-    answers = data.get('answers', {})
-    answers['additional'] = message.text
-    await state.update_data(answers=answers)
-    await ask_next_question(message.from_user.id, state)
-
+    # Gemini не успел или не ответил: сразу отдаем резервную подборку
+    fallback = render_fallback_recommendations(user1_answers, user2_answers, features)
+    await send_recommendations(deliveries, fallback)
 
-async def generate_and_send_recommendations(session_code: str, user1_answers: dict, user2_answers: dict):
-    """Генерация и отправка рекомендаций"""
-    session = db.get_session(session_code)
-    if not session:
+    if generation.done():
         return
 
-    user1_id, user2_id = session[1], session[2]
-
-    generating_msg = "🎭 Анализируем ваши предпочтения... ИИ подбирает идеальные фильмы!\n\nЭто может занять 10-15 секунд ⏳"
-
+    # Если Gemini ответит до жесткого дедлайна, заменяем подборку
+    remaining = GEMINI_HARD_DEADLINE - (time.monotonic() - started_at)
     try:
-        msg1 = await bot.send_message(user1_id, generating_msg)
-        msg2 = await bot.send_message(user2_id, generating_msg)
-    except Exception as e:
-        logger.error(f"Не удалось отправить сообщения: {e}")
+        recommendations = await asyncio.wait_for(generation, max(remaining, 0))
+    except asyncio.TimeoutError:
+        metrics.inc('generation_hard_timeouts')
         return
 
-    recommendations = await generate_movie_recommendations(user1_answers, user2_answers)
+    if recommendations:
+        metrics.inc('generation_upgrades')
+        metrics.observe('generation_time', time.monotonic() - started_at)
+        await send_recommendations(deliveries, recommendations)
 
-    result_text = f"""
-{recommendations}
-    """
 
+async def send_placeholder(chat_id: int):
+    """Сообщение-заглушка на время генерации; ошибка не мешает доставке позже"""
+    generating_msg = "🎭 Анализируем ваши предпочтения... ИИ подбирает идеальные фильмы!\n\nЭто может занять 10-15 секунд ⏳"
+    delivery = MessageDelivery(bot, chat_id, max_retries=DELIVERY_MAX_RETRIES)
     try:
-        await bot.edit_message_text(
-            result_text,
-            chat_id=user1_id,
-            message_id=msg1.message_id,
-            parse_mode='Markdown'
-        )
-        await bot.edit_message_text(
-            result_text,
-            chat_id=user2_id,
-            message_id=msg2.message_id,
-            parse_mode='Markdown'
-        )
+        message = await bot.send_message(chat_id, generating_msg)
+        delivery.message_ids.append(message.message_id)
     except Exception as e:
-        logger.error(f"Не удалось отправить рекомендации: {e}")
-        try:
-            await bot.send_message(user1_id, result_text, parse_mode='Markdown')
-            await bot.send_message(user2_id, result_text, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Не удалось отправить новые сообщения: {e}")
+        logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+    return delivery
 
 
-async def delete_expired_session(session_code: str, delay_seconds: int = 3600):
-    """Удаление просроченной сессии"""
-    await asyncio.sleep(delay_seconds)
+async def send_recommendations(deliveries: list, recommendations: str):
+    """Рекомендации обоим пользователям одновременно, с разбиением по лимиту длины"""
+    delivered = await fan_out(deliveries, recommendations, parse_mode=RECOMMENDATIONS_PARSE_MODE)
+    if delivered < len(deliveries):
+        logger.error(f"Рекомендации доставлены {delivered} из {len(deliveries)} пользователей")
 
-    session = db.get_session(session_code)
-    if session and session[2] is None:
-        conn = sqlite3.connect('movies.db')
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_code,))
-        conn.commit()
-        conn.close()
 
-        try:
+async def notify_session_expired(creator_id: int):
+    """Уведомление создателя об истекшей сессии"""
+    try:
+        # Массовые уведомления уступают очередь ответам пользователям
+        with send_priority(PRIORITY_BULK):
             await bot.send_message(
-                session[1],
+                creator_id,
                 "⏰ Время сессии истекло. Никто не присоединился.\n\n"
                 "Создайте новую сессию!",
                 reply_markup=get_main_keyboard()
             )
+    except Exception as e:
+        logger.error(f"Не удалось уведомить: {e}")
+
+
+async def expire_sessions():
+    """Удаление всех просроченных сессий пачками и уведомление создателей"""
+    while True:
+        expired = await db.pop_expired_sessions(SESSION_TTL_SECONDS, EXPIRY_BATCH_SIZE)
+        if expired:
+            metrics.inc('sessions_expired', len(expired))
+            await asyncio.gather(*(notify_session_expired(creator_id) for _, creator_id in expired))
+        if len(expired) < EXPIRY_BATCH_SIZE:
+            break
+
+    metrics.set_gauge('sessions_pending_expiration', await db.count_pending_expirations())
+    if speculation is not None:
+        metrics.set_gauge('speculation_running', len(speculation))
+
+    # Заодно чистим устаревшие записи кэша рекомендаций
+    await db.purge_recommendation_cache(int(time.time()))
+    metrics.set_gauge('recommendation_cache_resident', len(recommendation_cache))
+
+    # И завершенные задания генерации старше суток
+    await db.purge_generation_jobs(time.time() - 24 * 3600)
+    jobs = await db.count_generation_jobs()
+    metrics.set_gauge('generation_jobs_pending', jobs.get('pending', 0))
+    metrics.set_gauge('generation_jobs_running', jobs.get('running', 0))
+
+
+async def expire_sessions_loop():
+    """Единый фоновый планировщик истечения сессий.
+
+    Состояние хранится только в БД, поэтому после перезапуска бота
+    просроченные сессии все равно будут удалены.
+    """
+    while True:
+        try:
+            await expire_sessions()
+        except Exception as e:
+            logger.error(f"Ошибка при удалении просроченных сессий: {e}")
+        await asyncio.sleep(EXPIRY_SWEEP_INTERVAL)
+
+
+async def evict_abandoned_states():
+    """Вытеснение состояний FSM, простаивающих дольше STATE_IDLE_TTL"""
+    evicted = 0
+    abandoned = 0
+
+    for storage_key in activity.pop_idle(STATE_IDLE_TTL):
+        user_state = FSMContext(storage=storage, key=storage_key)
+        current_state = await user_state.get_state()
+        if current_state is None:
+            continue
+
+        data = await user_state.get_data()
+        session_code = data.get('session_code')
+        if "QuestionStates" in current_state and session_code:
+            if speculation is not None:
+                speculation.discard(session_code)
+            if await db.abandon_session(session_code):
+                abandoned += 1
+                # Второй участник мог уже ответить и ждать — отпускаем его
+                session = await db.get_session(session_code)
+                if session:
+                    partner_id = session[2] if session[1] == storage_key.user_id else session[1]
+                    await reset_users(
+                        [partner_id],
+                        "😔 Второй участник не закончил анкету, сессия закрыта.\n\n"
+                        "Создайте новую сессию, чтобы попробовать еще раз!"
+                    )
+
+        await user_state.clear()
+        evicted += 1
+
+    if evicted:
+        logger.info(f"Вытеснено брошенных состояний: {evicted}, сессий помечено брошенными: {abandoned}")
+    metrics.inc('fsm_states_evicted', evicted)
+    metrics.inc('sessions_abandoned', abandoned)
+    metrics.set_gauge('fsm_states_tracked', len(activity))
+    if isinstance(storage, SQLiteStorage):
+        metrics.set_gauge('fsm_states_cached', len(storage.cache))
+
+
+async def evict_abandoned_states_loop():
+    """Фоновая проверка брошенных анкет"""
+    if isinstance(storage, SQLiteStorage):
+        # Состояния из БД переживают перезапуск, поэтому учитываем и их;
+        # ключи пользователей других процессов трекер отбрасывает сам
+        activity.seed((parse_key(key), updated_at) for key, updated_at in await db.get_fsm_activity())
+
+    while True:
+        await asyncio.sleep(STATE_EVICTION_INTERVAL)
+        try:
+            await evict_abandoned_states()
         except Exception as e:
-            logger.error(f"Не удалось уведомить: {e}")
+            logger.error(f"Ошибка при вытеснении состояний: {e}")
 
 
 # Обработчик любых других сообщений
@@ -679,11 +977,102 @@ async def handle_other_messages(message: Message, state: FSMContext):
         )
 
 
+background_tasks = []
+
+
+@dp.startup()
+async def on_startup():
+    """Запуск общих для всех режимов служб"""
+    logger.info("🎬 Movie Match Bot запущен!")
+    await db.start()
+    await sender.start()
+    warm_up_models()
+    load_local_recommender()
+    if isinstance(storage, SQLiteStorage):
+        await storage.start()
+    await generation_queue.start()
+
+    background_tasks.append(asyncio.create_task(build_title_index()))
+
+    # Истекшие сессии удаляет один процесс, брошенные анкеты — каждый свои
+    if WEBHOOK_WORKER_INDEX in (None, 0):
+        background_tasks.append(asyncio.create_task(expire_sessions_loop()))
+    background_tasks.append(asyncio.create_task(evict_abandoned_states_loop()))
+
+    if BOT_MODE == 'webhook' and WEBHOOK_WORKERS == 1:
+        await set_webhook()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    # Хранилище FSM к этому моменту уже закрыто диспетчером
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await generation_queue.close()
+    await llm_dispatcher.close()
+    await sender.close()
+    await db.close()
+
+
+async def set_webhook():
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL не задан, вебхук должен быть установлен заранее")
+        return
+    await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+
+
+def run_webhook():
+    """Прием обновлений через вебхук.
+
+    С одним процессом бот сам слушает WEBHOOK_PORT. С несколькими
+    на WEBHOOK_PORT работает только маршрутизатор, а обновления
+    обрабатывают рабочие процессы на соседних локальных портах.
+    """
+    if WEBHOOK_WORKER_INDEX is not None:
+        port = worker_port(WEBHOOK_PORT, WEBHOOK_WORKER_INDEX)
+        host, secret = '127.0.0.1', None
+    else:
+        if WEBHOOK_WORKERS > 1:
+            run_webhook_router()
+            return
+        host, port, secret = WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=host, port=port)
+
+
+def run_webhook_router():
+    """Маршрутизатор вебхука перед WEBHOOK_WORKERS рабочими процессами"""
+    if FSM_STORAGE != 'sqlite':
+        logger.warning("Несколько процессов используют общее хранилище FSM в SQLite, FSM_STORAGE не учитывается")
+
+    processes = start_workers(__file__, WEBHOOK_WORKERS, WEBHOOK_PORT)
+    app = create_router_app(WEBHOOK_PATH, WEBHOOK_WORKERS, WEBHOOK_PORT, secret=WEBHOOK_SECRET)
+
+    async def on_router_startup(app):
+        await set_webhook()
+
+    async def on_router_cleanup(app):
+        await bot.session.close()
+
+    app.on_startup.append(on_router_startup)
+    app.on_cleanup.append(on_router_cleanup)
+    try:
+        web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    finally:
+        stop_workers(processes)
+
+
 async def main():
     """Основная функция"""
-    logger.info("🎬 Movie Match Bot запущен!")
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,189 @@
+import argparse
+import csv
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from features import GENRE_BITS, genres_from_mask, normalize_genre
+
+# Бинарный формат каталога: заголовок, затем колонки фиксированной ширины
+# (годы, длительности, рейтинги, маски жанров), смещения названий и сами
+# названия одним UTF-8 блоком. Все секции выровнены по 8 байт.
+CATALOG_MAGIC = b'MMCAT001'
+HEADER = struct.Struct('<8sIQ')  # magic, число фильмов, размер блока названий
+COLUMNS = [
+    ('years', np.int16),
+    ('runtimes', np.int16),
+    ('ratings', np.float32),
+    ('genre_masks', np.uint32),
+]
+
+
+def genres_to_mask(genres):
+    """Битовая маска жанров по списку названий (русских или английских)"""
+    mask = 0
+    for name in genres:
+        genre = normalize_genre(name)
+        if genre:
+            mask |= GENRE_BITS[genre]
+    return mask
+
+
+def split_genres(value):
+    if isinstance(value, list):
+        return value
+    return [part for part in str(value or '').replace('|', ',').split(',') if part.strip()]
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+class TitleBlob:
+    """Названия фильмов из общего UTF-8 блока; строка декодируется при обращении"""
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return bytes(self.buffer[start:end]).decode('utf-8')
+
+
+class MovieCatalog:
+    """Каталог фильмов в колоночном виде: массивы NumPy по полям.
+
+    Пустые значения хранятся нулями: год 0, рейтинг 0, длительность 0.
+    """
+
+    def __init__(self, titles, years, ratings, runtimes, genre_masks):
+        self.titles = titles
+        self.years = years
+        self.ratings = ratings
+        self.runtimes = runtimes
+        self.genre_masks = genre_masks
+
+    def __len__(self):
+        return len(self.years)
+
+    def movie(self, index):
+        """Фильм в формате, общем для всех источников рекомендаций"""
+        return {
+            "title": self.titles[index],
+            "year": int(self.years[index]) or None,
+            "genres": genres_from_mask(int(self.genre_masks[index])),
+            "rating": round(float(self.ratings[index]), 1) or None,
+        }
+
+    @classmethod
+    def open_binary(cls, path):
+        """Каталог поверх файла, отображенного в память.
+
+        Данные не копируются: массивы NumPy ссылаются прямо на страницы
+        файла, поэтому загрузка почти мгновенная, а несколько процессов
+        бота разделяют одни и те же страницы в памяти.
+        """
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, blob_size = HEADER.unpack_from(buffer, 0)
+        if magic != CATALOG_MAGIC:
+            raise ValueError(f"{path}: не бинарный каталог фильмов")
+
+        offset = _aligned(HEADER.size)
+        columns = {}
+        for name, dtype in COLUMNS:
+            columns[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset = _aligned(offset + count * np.dtype(dtype).itemsize)
+
+        title_offsets = np.frombuffer(buffer, dtype=np.uint64, count=count + 1, offset=offset)
+        offset += (count + 1) * 8
+        titles = TitleBlob(memoryview(buffer)[offset:offset + blob_size], title_offsets)
+
+        return cls(titles, **columns)
+
+    def save_binary(self, path):
+        """Запись каталога в бинарный формат для open_binary"""
+        encoded = [title.encode('utf-8') for title in self.titles]
+        title_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        title_offsets[1:] = np.cumsum([len(title) for title in encoded])
+        blob = b''.join(encoded)
+
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(CATALOG_MAGIC, len(self), len(blob)))
+            for name, dtype in COLUMNS:
+                file.write(b'\0' * (_aligned(file.tell()) - file.tell()))
+                file.write(np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes())
+            file.write(b'\0' * (_aligned(file.tell()) - file.tell()))
+            file.write(title_offsets.tobytes())
+            file.write(blob)
+
+    @classmethod
+    def from_records(cls, records):
+        """Каталог из словарей с полями title, year, rating, runtime, genres"""
+        titles = []
+        years = []
+        ratings = []
+        runtimes = []
+        genre_masks = []
+
+        for record in records:
+            title = str(record.get('title') or '').strip()
+            if not title:
+                continue
+            titles.append(title)
+            years.append(_to_number(record.get('year'), int))
+            ratings.append(_to_number(record.get('rating'), float))
+            runtimes.append(_to_number(record.get('runtime'), int))
+            genre_masks.append(genres_to_mask(split_genres(record.get('genres'))))
+
+        return cls(
+            titles,
+            np.array(years, dtype=np.int16),
+            np.array(ratings, dtype=np.float32),
+            np.array(runtimes, dtype=np.int16),
+            np.array(genre_masks, dtype=np.uint32)
+        )
+
+
+def _to_number(value, kind):
+    try:
+        return kind(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def load_catalog(path):
+    """Загрузка каталога: бинарный формат, CSV или JSON (список объектов)"""
+    with open(path, 'rb') as file:
+        is_binary = file.read(len(CATALOG_MAGIC)) == CATALOG_MAGIC
+    if is_binary:
+        return MovieCatalog.open_binary(path)
+
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as file:
+            return MovieCatalog.from_records(json.load(file))
+
+    with open(path, encoding='utf-8', newline='') as file:
+        return MovieCatalog.from_records(csv.DictReader(file))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка бинарного каталога фильмов")
+    parser.add_argument('source', help="CSV или JSON с полями title, year, rating, runtime, genres")
+    parser.add_argument('target', help="путь к бинарному каталогу")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.source)
+    catalog.save_binary(args.target)
+    print(f"Собран каталог: {len(catalog)} фильмов -> {args.target}")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,94 @@ GEMINI_MODEL = os.getenv('GEMINI_MODEL')
 GEMINI_TEMPERATURE = 0.7
 GEMINI_MAX_TOKENS = 2000
 
+# Структурный режим: Gemini возвращает JSON со списком фильмов, а бот сам
+# оформляет его в HTML для Telegram. Ответ короче, поэтому лимит токенов меньше
+GEMINI_STRUCTURED_OUTPUT = os.getenv('GEMINI_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+GEMINI_STRUCTURED_MAX_TOKENS = int(os.getenv('GEMINI_STRUCTURED_MAX_TOKENS', 1000))
+
+# Источник рекомендаций: 'gemini' или 'local' (подбор по каталогу фильмов).
+# Если каталог задан, он же используется вместо встроенной резервной подборки
+RECOMMENDATION_BACKEND = os.getenv('RECOMMENDATION_BACKEND', 'gemini')
+MOVIE_CATALOG_PATH = os.getenv('MOVIE_CATALOG_PATH')
+# Оценка пары: 'harmonic' (среднее гармоническое) или 'min'
+LOCAL_JOINT_OBJECTIVE = os.getenv('LOCAL_JOINT_OBJECTIVE', 'harmonic')
+LOCAL_TOP_K = int(os.getenv('LOCAL_TOP_K', 6))
+
+# Ограничение параллельных запросов к Gemini и длины очереди ожидания
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 4))
+GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', 100))
+
+# Потоковая генерация: частичный ответ показывается правкой сообщения
+# не чаще одного раза в STREAM_EDIT_INTERVAL секунд (лимиты Telegram)
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+
+# Бюджет ожидания ответа Gemini на сессию, в секундах: после мягкого дедлайна
+# пользователи получают резервную подборку, до жесткого ее еще можно заменить
+GEMINI_SOFT_DEADLINE = float(os.getenv('GEMINI_SOFT_DEADLINE', 20))
+GEMINI_HARD_DEADLINE = float(os.getenv('GEMINI_HARD_DEADLINE', 60))
+
+# Спекулятивная генерация: запуск в фоне, когда оба ответили на все вопросы,
+# кроме последнего (дополнительные пожелания обычно пропускают)
+SPECULATIVE_GENERATION = os.getenv('SPECULATIVE_GENERATION', 'true').lower() == 'true'
+
+# Кэш рекомендаций: размер в памяти и время жизни в секундах
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 1000))
+RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 7 * 24 * 3600))
+
+# Настройки базы данных
+DB_PATH = os.getenv('DB_PATH', 'movies.db')
+
+# Истечение сессий, к которым никто не присоединился
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 3600))
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 60))
+EXPIRY_BATCH_SIZE = 500
+
+# Хранилище состояний FSM: 'sqlite' (переживает перезапуск) или 'memory'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 0.5))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+
+# Вытеснение брошенных анкет: время простоя и период проверки в секундах
+STATE_IDLE_TTL = int(os.getenv('STATE_IDLE_TTL', 6 * 3600))
+STATE_EVICTION_INTERVAL = int(os.getenv('STATE_EVICTION_INTERVAL', 300))
+STATE_TRACKER_MAX_KEYS = int(os.getenv('STATE_TRACKER_MAX_KEYS', 100000))
+
+# Исходящие сообщения: общий лимит и лимит на чат (сообщений в секунду),
+# допустимая серия подряд в одном чате и число повторов после retry-after
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 3))
+
+# Повторы доставки рекомендаций при сетевых ошибках и ошибках сервера Telegram
+DELIVERY_MAX_RETRIES = int(os.getenv('DELIVERY_MAX_RETRIES', 3))
+
+# Адрес Bot API, например локального сервера или заглушки для проверки
+# нагрузки; по умолчанию https://api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Очередь генерации: исполнители в процессе, аренда задания в секундах
+# (продлевается, пока задание выполняется) и число попыток
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 4))
+GENERATION_JOB_LEASE = float(os.getenv('GENERATION_JOB_LEASE', 30))
+GENERATION_JOB_MAX_ATTEMPTS = int(os.getenv('GENERATION_JOB_MAX_ATTEMPTS', 3))
+
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Вебхук: публичный адрес (https://example.com) и путь; если WEBHOOK_URL
+# не задан, вебхук должен быть установлен заранее
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Число рабочих процессов за одним портом; обновления делятся по user_id
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 1))
+# Номер рабочего процесса; задается автоматически при запуске процессов
+WEBHOOK_WORKER_INDEX = int(os.environ['WEBHOOK_WORKER_INDEX']) if os.getenv('WEBHOOK_WORKER_INDEX') else None
+
 # Проверка обязательных переменных
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле")
@@ -1,137 +1,708 @@
+import asyncio
 import sqlite3
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Миграции схемы. Версия схемы хранится в PRAGMA user_version и равна
+# количеству примененных миграций; новые миграции добавляются в конец списка.
+MIGRATIONS = [
+    # 1: частичные покрывающие индексы незавершенных сессий по участникам
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user1_open
+        ON sessions (user1_id, session_id, status, user2_id, created_at)
+        WHERE status != 'completed'
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user2_open
+        ON sessions (user2_id, session_id, status, user1_id, created_at)
+        WHERE status != 'completed'
+        ''',
+    ],
+    # 2: индекс ожидающих сессий по времени создания для фонового истечения
+    [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_waiting_created
+        ON sessions (created_at)
+        WHERE status = 'waiting'
+        ''',
+    ],
+    # 3: хранилище состояний FSM
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 4: кэш рекомендаций по нормализованным ответам пары
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS recommendation_cache (
+            key TEXT PRIMARY KEY,
+            recommendations TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 5: признаки ответов, собранные в момент ответа (features.update_features)
+    [
+        'ALTER TABLE sessions ADD COLUMN user1_features TEXT',
+        'ALTER TABLE sessions ADD COLUMN user2_features TEXT',
+    ],
+    # 6: очередь генерации рекомендаций; session_id — ключ идемпотентности
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            enqueued_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_until REAL,
+            last_error TEXT,
+            finished_at REAL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_ready
+        ON generation_jobs (status, available_at)
+        ''',
+    ],
+    # 7: счетчик номеров сессий и ключ перестановки номеров в коды
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS session_code_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            next_number INTEGER NOT NULL,
+            secret BLOB NOT NULL
+        )
+        ''',
+    ],
+]
 
 
 class Database:
     def __init__(self, db_path='movies.db'):
         self.db_path = db_path
+        # Одно долгоживущее соединение на процесс вместо connect/close на каждый вызов.
+        # sqlite3 кэширует подготовленные выражения (cached_statements), поэтому
+        # SQL-тексты ниже — константы и переиспользуются между вызовами.
+        self.conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=128
+        )
+        self.lock = threading.RLock()
+        self.batch_depth = 0
+        self.configure_connection()
         self.init_db()
 
+    def configure_connection(self):
+        """Настройка соединения: WAL-журнал и прагмы производительности"""
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute('PRAGMA cache_size = -16000')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('PRAGMA busy_timeout = 5000')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def commit(self):
+        # Внутри batch() коммит откладывается до конца пакета
+        if self.batch_depth == 0:
+            self.conn.commit()
+
+    @contextmanager
+    def batch(self):
+        """Групповой коммит: все записи внутри блока фиксируются одним commit"""
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.conn.commit()
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Таблица сессий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                user1_id INTEGER,
-                user2_id INTEGER,
-                user1_answers TEXT,
-                user2_answers TEXT,
-                status TEXT DEFAULT 'waiting',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                finished_at TIMESTAMP
-            )
-        ''')
+        with self.lock:
+            cursor = self.conn.cursor()
 
-        conn.commit()
-        conn.close()
+            # Таблица пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-    def add_user(self, user_id, username, first_name):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+            # Таблица сессий
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user1_id INTEGER,
+                    user2_id INTEGER,
+                    user1_answers TEXT,
+                    user2_answers TEXT,
+                    status TEXT DEFAULT 'waiting',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
 
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name)
-            VALUES (?, ?, ?)
-        ''', (user_id, username, first_name))
+            self.conn.commit()
 
-        conn.commit()
-        conn.close()
+        self.apply_migrations()
 
-    def create_session(self, session_id, user1_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_schema_version(self):
+        with self.lock:
+            return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def apply_migrations(self):
+        """Применение недостающих миграций при старте"""
+        with self.lock:
+            while True:
+                # Версия читается под блокировкой записи: процессы, стартующие
+                # одновременно, применяют каждую миграцию ровно один раз
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    version = self.get_schema_version()
+                    if version >= len(MIGRATIONS):
+                        self.conn.commit()
+                        return
+
+                    # Миграция и смена версии фиксируются одной транзакцией
+                    for statement in MIGRATIONS[version]:
+                        self.conn.execute(statement)
+                    self.conn.execute(f'PRAGMA user_version = {version + 1}')
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
 
-        cursor.execute('''
-            INSERT INTO sessions (session_id, user1_id, status)
-            VALUES (?, ?, 'waiting')
-        ''', (session_id, user1_id))
+    def add_user(self, user_id, username, first_name):
+        with self.lock:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO users (user_id, username, first_name)
+                VALUES (?, ?, ?)
+            ''', (user_id, username, first_name))
+            self.commit()
 
-        conn.commit()
-        conn.close()
+    def create_session(self, session_id, user1_id):
+        with self.lock:
+            self.conn.execute('''
+                INSERT INTO sessions (session_id, user1_id, status)
+                VALUES (?, ?, 'waiting')
+            ''', (session_id, user1_id))
+            self.commit()
 
     def join_session(self, session_id, user2_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.lock:
+            self.conn.execute('''
+                UPDATE sessions 
+                SET user2_id = ?, status = 'active'
+                WHERE session_id = ? AND status = 'waiting'
+            ''', (user2_id, session_id))
+            self.commit()
+
+    def save_user_answers(self, session_id, user_id, answers, features=None):
+        with self.lock:
+            cursor = self.conn.cursor()
+
+            # Определяем, какой это пользователь в сессии
+            cursor.execute('SELECT user1_id, user2_id FROM sessions WHERE session_id = ?', (session_id,))
+            session = cursor.fetchone()
+
+            if session:
+                user_prefix = 'user1' if session[0] == user_id else 'user2'
+                answers_json = json.dumps(answers)
+                features_json = json.dumps(features, separators=(',', ':')) if features else None
 
-        cursor.execute('''
-            UPDATE sessions 
-            SET user2_id = ?, status = 'active'
-            WHERE session_id = ? AND status = 'waiting'
-        ''', (user2_id, session_id))
+                cursor.execute(f'''
+                    UPDATE sessions 
+                    SET {user_prefix}_answers = ?, {user_prefix}_features = ?
+                    WHERE session_id = ?
+                ''', (answers_json, features_json, session_id))
 
-        conn.commit()
-        conn.close()
+            self.commit()
 
-    def save_user_answers(self, session_id, user_id, answers):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_session(self, session_id):
+        with self.lock:
+            cursor = self.conn.execute('''
+                SELECT * FROM sessions WHERE session_id = ?
+            ''', (session_id,))
+            return cursor.fetchone()
+
+    def get_both_answers(self, session_id, with_features=False):
+        """Ответы обоих пользователей; с with_features — еще и их признаки
+        (None для сессий, сохраненных без признаков)"""
+        with self.lock:
+            cursor = self.conn.execute('''
+                SELECT user1_answers, user2_answers, user1_features, user2_features
+                FROM sessions WHERE session_id = ?
+            ''', (session_id,))
+            result = cursor.fetchone()
+
+        if not with_features:
+            if result and result[0] and result[1]:
+                return json.loads(result[0]), json.loads(result[1])
+            return None, None
+
+        if result and result[0] and result[1]:
+            return tuple(json.loads(value) if value else None for value in result)
+        return None, None, None, None
 
-        # Определяем, какой это пользователь в сессии
-        cursor.execute('SELECT user1_id, user2_id FROM sessions WHERE session_id = ?', (session_id,))
-        session = cursor.fetchone()
+    def claim_completion(self, session_id, now):
+        """Атомарный захват генерации рекомендаций.
 
-        if session:
-            user_field = 'user1_answers' if session[0] == user_id else 'user2_answers'
-            answers_json = json.dumps(answers)
+        Переводит сессию из 'active' в 'generating', только если оба ответа
+        уже сохранены. Условие проверяется в том же UPDATE, поэтому True
+        получает ровно один вызывающий, даже из разных процессов бота.
+        В той же транзакции ставится задание генерации.
+        """
+        with self.lock:
+            with self.batch():
+                cursor = self.conn.execute('''
+                    UPDATE sessions
+                    SET status = 'generating'
+                    WHERE session_id = ? AND status = 'active'
+                      AND user1_answers IS NOT NULL AND user2_answers IS NOT NULL
+                ''', (session_id,))
+                claimed = cursor.rowcount == 1
+                if claimed:
+                    self.conn.execute('''
+                        INSERT OR IGNORE INTO generation_jobs (session_id, available_at, enqueued_at)
+                        VALUES (?, ?, ?)
+                    ''', (session_id, now, now))
+            return claimed
 
-            cursor.execute(f'''
+    def requeue_generating_sessions(self, now):
+        """Задания для сессий в 'generating' без задания (генерация прервана
+        до появления очереди); возвращает число новых заданий"""
+        with self.lock:
+            cursor = self.conn.execute('''
+                INSERT OR IGNORE INTO generation_jobs (session_id, available_at, enqueued_at)
+                SELECT session_id, ?, ? FROM sessions WHERE status = 'generating'
+            ''', (now, now))
+            self.commit()
+            return cursor.rowcount
+
+    def claim_generation_job(self, owner, now, lease_seconds):
+        """Аренда следующего готового задания: ожидающего или с истекшей арендой
+        (его исполнитель упал). Возвращает (job_id, session_id, attempts, enqueued_at)"""
+        with self.lock:
+            row = self.conn.execute('''
+                SELECT job_id, session_id, attempts, enqueued_at FROM generation_jobs
+                WHERE (status = 'pending' AND available_at <= ?)
+                   OR (status = 'running' AND lease_until < ?)
+                ORDER BY available_at
+                LIMIT 1
+            ''', (now, now)).fetchone()
+            if row is None:
+                return None
+
+            job_id, session_id, attempts, enqueued_at = row
+            # Условие повторяется в UPDATE: задание получит только один процесс
+            cursor = self.conn.execute('''
+                UPDATE generation_jobs
+                SET status = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1
+                WHERE job_id = ?
+                  AND ((status = 'pending' AND available_at <= ?) OR (status = 'running' AND lease_until < ?))
+            ''', (owner, now + lease_seconds, job_id, now, now))
+            self.commit()
+            if cursor.rowcount != 1:
+                return None
+            return job_id, session_id, attempts + 1, enqueued_at
+
+    def extend_generation_job(self, job_id, owner, lease_until):
+        """Продление аренды; False, если задание уже забрал другой исполнитель"""
+        with self.lock:
+            cursor = self.conn.execute('''
+                UPDATE generation_jobs SET lease_until = ?
+                WHERE job_id = ? AND lease_owner = ? AND status = 'running'
+            ''', (lease_until, job_id, owner))
+            self.commit()
+            return cursor.rowcount == 1
+
+    def finish_generation_job(self, job_id, owner, now, status='done', error=None):
+        """Завершение задания: 'done' или 'failed'; True, если задание завершил owner.
+
+        Вместе с неудачным заданием сессия той же транзакцией переводится
+        в 'failed': иначе она осталась бы в 'generating' и после очистки
+        заданий снова попала бы в очередь при перезапуске.
+        """
+        with self.lock:
+            with self.batch():
+                cursor = self.conn.execute('''
+                    UPDATE generation_jobs
+                    SET status = ?, last_error = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL
+                    WHERE job_id = ? AND lease_owner = ?
+                ''', (status, error, now, job_id, owner))
+                finished = cursor.rowcount == 1
+                if finished and status == 'failed':
+                    self.conn.execute('''
+                        UPDATE sessions
+                        SET status = 'failed', finished_at = CURRENT_TIMESTAMP
+                        WHERE status = 'generating'
+                          AND session_id = (SELECT session_id FROM generation_jobs WHERE job_id = ?)
+                    ''', (job_id,))
+            return finished
+
+    def retry_generation_job(self, job_id, owner, available_at, error=None, count_attempt=True):
+        """Возврат задания в очередь; без count_attempt попытка не засчитывается"""
+        with self.lock:
+            self.conn.execute('''
+                UPDATE generation_jobs
+                SET status = 'pending', available_at = ?, last_error = ?,
+                    attempts = attempts - ?, lease_owner = NULL, lease_until = NULL
+                WHERE job_id = ? AND lease_owner = ?
+            ''', (available_at, error, 0 if count_attempt else 1, job_id, owner))
+            self.commit()
+
+    def count_generation_jobs(self):
+        """Число заданий по статусам"""
+        with self.lock:
+            return dict(self.conn.execute(
+                'SELECT status, COUNT(*) FROM generation_jobs GROUP BY status'
+            ).fetchall())
+
+    def purge_generation_jobs(self, before):
+        """Удаление завершенных заданий старше before"""
+        with self.lock:
+            cursor = self.conn.execute('''
+                DELETE FROM generation_jobs
+                WHERE status IN ('done', 'failed') AND finished_at < ?
+            ''', (before,))
+            self.commit()
+            return cursor.rowcount
+
+    def abandon_session(self, session_id):
+        """Пометка брошенной сессии; True, если сессия была активной"""
+        with self.lock:
+            cursor = self.conn.execute('''
+                UPDATE sessions
+                SET status = 'abandoned', finished_at = CURRENT_TIMESTAMP
+                WHERE session_id = ? AND status = 'active'
+            ''', (session_id,))
+            self.commit()
+            return cursor.rowcount == 1
+
+    def complete_session(self, session_id):
+        with self.lock:
+            self.conn.execute('''
                 UPDATE sessions 
-                SET {user_field} = ?
+                SET status = 'completed', finished_at = CURRENT_TIMESTAMP
                 WHERE session_id = ?
-            ''', (answers_json, session_id))
+            ''', (session_id,))
+            self.commit()
 
-        conn.commit()
-        conn.close()
+    def pop_expired_sessions(self, max_age_seconds, limit=500):
+        """Удаление пачки просроченных ожидающих сессий.
 
-    def get_session(self, session_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Возвращает [(session_id, user1_id)] только для реально удаленных
+        строк, поэтому при нескольких процессах уведомление уйдет один раз.
+        """
+        with self.lock:
+            expired = self.conn.execute('''
+                SELECT session_id, user1_id FROM sessions
+                WHERE status = 'waiting' AND created_at < datetime('now', ?)
+                ORDER BY created_at
+                LIMIT ?
+            ''', (f'-{int(max_age_seconds)} seconds', limit)).fetchall()
 
-        cursor.execute('''
-            SELECT * FROM sessions WHERE session_id = ?
-        ''', (session_id,))
+            deleted = []
+            with self.batch():
+                for session_id, user1_id in expired:
+                    cursor = self.conn.execute('''
+                        DELETE FROM sessions WHERE session_id = ? AND status = 'waiting'
+                    ''', (session_id,))
+                    if cursor.rowcount == 1:
+                        deleted.append((session_id, user1_id))
+            return deleted
 
-        session = cursor.fetchone()
-        conn.close()
-        return session
+    def get_cached_recommendation(self, key, now):
+        with self.lock:
+            return self.conn.execute('''
+                SELECT recommendations, expires_at FROM recommendation_cache
+                WHERE key = ? AND expires_at > ?
+            ''', (key, now)).fetchone()
 
-    def get_both_answers(self, session_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def save_cached_recommendation(self, key, recommendations, expires_at):
+        with self.lock:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO recommendation_cache (key, recommendations, expires_at)
+                VALUES (?, ?, ?)
+            ''', (key, recommendations, expires_at))
+            self.commit()
 
-        cursor.execute('''
-            SELECT user1_answers, user2_answers FROM sessions WHERE session_id = ?
-        ''', (session_id,))
+    def purge_recommendation_cache(self, now):
+        with self.lock:
+            cursor = self.conn.execute(
+                'DELETE FROM recommendation_cache WHERE expires_at <= ?', (now,)
+            )
+            self.commit()
+            return cursor.rowcount
 
-        result = cursor.fetchone()
-        conn.close()
+    def reserve_session_numbers(self, count, secret):
+        """Блок из count номеров для кодов сессий: (первый номер, ключ).
 
-        if result and result[0] and result[1]:
-            return json.loads(result[0]), json.loads(result[1])
-        return None, None
+        Счетчик общий для всех процессов бота. Ключ сохраняется из secret
+        при первом вызове и дальше не меняется.
+        """
+        with self.lock:
+            with self.batch():
+                self.conn.execute('''
+                    INSERT OR IGNORE INTO session_code_counter (id, next_number, secret)
+                    VALUES (0, 0, ?)
+                ''', (secret,))
+                self.conn.execute(
+                    'UPDATE session_code_counter SET next_number = next_number + ? WHERE id = 0', (count,)
+                )
+                next_number, key = self.conn.execute(
+                    'SELECT next_number, secret FROM session_code_counter WHERE id = 0'
+                ).fetchone()
+            return next_number - count, key
 
-    def complete_session(self, session_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def count_pending_expirations(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE status = 'waiting'"
+            ).fetchone()[0]
+
+    def get_fsm_activity(self):
+        """Ключи FSM с непустым состоянием и время их последнего изменения"""
+        with self.lock:
+            return self.conn.execute('''
+                SELECT key, CAST(strftime('%s', updated_at) AS INTEGER)
+                FROM fsm_storage
+                WHERE state IS NOT NULL
+            ''').fetchall()
+
+    def load_fsm_record(self, key):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT state, data FROM fsm_storage WHERE key = ?', (key,)
+            ).fetchone()
+
+    def save_fsm_records(self, upserts, deletes):
+        """Пакетная запись состояний FSM: upserts = [(key, state, data_json)]"""
+        with self.lock:
+            with self.batch():
+                self.conn.executemany('''
+                    INSERT INTO fsm_storage (key, state, data, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                ''', upserts)
+                self.conn.executemany(
+                    'DELETE FROM fsm_storage WHERE key = ?', [(key,) for key in deletes]
+                )
+
+    def get_active_session_by_creator(self, user_id):
+        with self.lock:
+            cursor = self.conn.execute('''
+                SELECT session_id FROM sessions
+                WHERE user1_id = ? AND status != 'completed' AND status != 'abandoned' AND status != 'failed'
+                LIMIT 1
+            ''', (user_id,))
+            return cursor.fetchone()
+
+    def get_user_sessions(self, user_id):
+        """Незавершенные сессии пользователя: (как создатель, как участник)"""
+        # Один запрос; каждая ветка UNION читает только свой частичный индекс
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT 1, session_id, status, user2_id, created_at
+                FROM sessions
+                WHERE user1_id = ? AND status != 'completed' AND status != 'abandoned' AND status != 'failed'
+                UNION ALL
+                SELECT 0, session_id, status, user1_id, created_at
+                FROM sessions
+                WHERE user2_id = ? AND status != 'completed' AND status != 'abandoned' AND status != 'failed'
+            ''', (user_id, user_id)).fetchall()
+
+        creator_sessions = [row[1:] for row in rows if row[0]]
+        participant_sessions = [row[1:] for row in rows if not row[0]]
+        return creator_sessions, participant_sessions
+
+    def delete_session(self, session_id):
+        with self.lock:
+            self.conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            self.commit()
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database.
+
+    Все обращения к SQLite выполняются в одном выделенном потоке, поэтому
+    ожидание блокировок и fsync не останавливают цикл событий aiogram.
+    Записи попадают в очередь, и писатель фиксирует накопившиеся за время
+    предыдущего коммита операции одной транзакцией (group commit).
+    """
+
+    def __init__(self, database, max_batch_size=100):
+        self.db = database
+        self.max_batch_size = max_batch_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.write_queue = None
+        self.writer_task = None
+
+    async def start(self):
+        """Запуск писателя; вызывается из работающего цикла событий"""
+        if self.writer_task is None:
+            self.write_queue = asyncio.Queue()
+            self.writer_task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        if self.writer_task is not None:
+            await self.write_queue.join()
+            self.writer_task.cancel()
+            self.writer_task = None
+        await self.read(self.db.close)
+        self.executor.shutdown(wait=True)
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def write(self, func, *args):
+        if self.writer_task is None:
+            return await self.read(func, *args)
+
+        future = asyncio.get_running_loop().create_future()
+        self.write_queue.put_nowait((func, args, future))
+        return await future
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.write_queue.get()]
+            while len(batch) < self.max_batch_size and not self.write_queue.empty():
+                batch.append(self.write_queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(self.executor, self._apply_batch, batch)
+            except Exception as e:
+                results = [(None, e)] * len(batch)
+
+            for (_, _, future), (result, error) in zip(batch, results):
+                if future.done():
+                    pass
+                elif error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+                self.write_queue.task_done()
+
+    def _apply_batch(self, batch):
+        results = []
+        with self.db.batch():
+            for func, args, _ in batch:
+                try:
+                    results.append((func(*args), None))
+                except Exception as e:
+                    results.append((None, e))
+        return results
+
+    # Записи
+
+    async def add_user(self, user_id, username, first_name):
+        return await self.write(self.db.add_user, user_id, username, first_name)
+
+    async def create_session(self, session_id, user1_id):
+        return await self.write(self.db.create_session, session_id, user1_id)
+
+    async def join_session(self, session_id, user2_id):
+        return await self.write(self.db.join_session, session_id, user2_id)
+
+    async def save_user_answers(self, session_id, user_id, answers, features=None):
+        return await self.write(self.db.save_user_answers, session_id, user_id, answers, features)
+
+    async def claim_completion(self, session_id, now):
+        return await self.write(self.db.claim_completion, session_id, now)
+
+    async def requeue_generating_sessions(self, now):
+        return await self.write(self.db.requeue_generating_sessions, now)
+
+    async def claim_generation_job(self, owner, now, lease_seconds):
+        return await self.write(self.db.claim_generation_job, owner, now, lease_seconds)
+
+    async def extend_generation_job(self, job_id, owner, lease_until):
+        return await self.write(self.db.extend_generation_job, job_id, owner, lease_until)
+
+    async def finish_generation_job(self, job_id, owner, now, status='done', error=None):
+        return await self.write(self.db.finish_generation_job, job_id, owner, now, status, error)
+
+    async def retry_generation_job(self, job_id, owner, available_at, error=None, count_attempt=True):
+        return await self.write(self.db.retry_generation_job, job_id, owner, available_at, error, count_attempt)
+
+    async def purge_generation_jobs(self, before):
+        return await self.write(self.db.purge_generation_jobs, before)
+
+    async def reserve_session_numbers(self, count, secret):
+        return await self.write(self.db.reserve_session_numbers, count, secret)
+
+    async def abandon_session(self, session_id):
+        return await self.write(self.db.abandon_session, session_id)
+
+    async def complete_session(self, session_id):
+        return await self.write(self.db.complete_session, session_id)
+
+    async def delete_session(self, session_id):
+        return await self.write(self.db.delete_session, session_id)
+
+    async def save_fsm_records(self, upserts, deletes):
+        return await self.write(self.db.save_fsm_records, upserts, deletes)
+
+    async def save_cached_recommendation(self, key, recommendations, expires_at):
+        return await self.write(self.db.save_cached_recommendation, key, recommendations, expires_at)
+
+    async def purge_recommendation_cache(self, now):
+        return await self.write(self.db.purge_recommendation_cache, now)
+
+    async def pop_expired_sessions(self, max_age_seconds, limit=500):
+        return await self.write(self.db.pop_expired_sessions, max_age_seconds, limit)
+
+    # Чтения
+
+    async def get_session(self, session_id):
+        return await self.read(self.db.get_session, session_id)
+
+    async def count_generation_jobs(self):
+        return await self.read(self.db.count_generation_jobs)
+
+    async def get_both_answers(self, session_id, with_features=False):
+        return await self.read(self.db.get_both_answers, session_id, with_features)
+
+    async def get_active_session_by_creator(self, user_id):
+        return await self.read(self.db.get_active_session_by_creator, user_id)
+
+    async def get_user_sessions(self, user_id):
+        return await self.read(self.db.get_user_sessions, user_id)
+
+    async def get_fsm_activity(self):
+        return await self.read(self.db.get_fsm_activity)
+
+    async def load_fsm_record(self, key):
+        return await self.read(self.db.load_fsm_record, key)
 
-        cursor.execute('''
-            UPDATE sessions 
-            SET status = 'completed', finished_at = CURRENT_TIMESTAMP
-            WHERE session_id = ?
-        ''', (session_id,))
+    async def get_cached_recommendation(self, key, now):
+        return await self.read(self.db.get_cached_recommendation, key, now)
 
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    async def count_pending_expirations(self):
+        return await self.read(self.db.count_pending_expirations)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramServerError
+
+from rendering import split_message, to_plain_text
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDelivery:
+    """Доставка текста в один чат.
+
+    Помнит ID уже отправленных сообщений: первая часть текста заменяет
+    сообщение-заглушку, следующая версия текста (например, ответ Gemini
+    после резервной подборки) правит те же сообщения, лишние удаляются.
+    Поэтому повторная доставка не создает дубликатов. Сетевые ошибки и
+    ошибки сервера Telegram повторяются с экспоненциальной паузой, а
+    разметка, которую Telegram не принял, заменяется обычным текстом.
+    """
+
+    def __init__(self, bot, chat_id, message_ids=(), max_retries=3, retry_delay=1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_ids = list(message_ids)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    async def deliver(self, text, parse_mode=None):
+        parts = split_message(text, parse_mode=parse_mode)
+        for index, part in enumerate(parts):
+            await self._put(index, part, parse_mode)
+
+        # Лишние сообщения прошлой, более длинной версии текста
+        for message_id in self.message_ids[len(parts):]:
+            try:
+                await self.bot.delete_message(self.chat_id, message_id)
+            except Exception as e:
+                logger.debug(f"Не удалось удалить сообщение: {e}")
+        del self.message_ids[len(parts):]
+
+    async def _put(self, index, text, parse_mode):
+        try:
+            await self._put_part(index, text, parse_mode)
+        except TelegramBadRequest as e:
+            if not parse_mode or "can't parse entities" not in str(e):
+                raise
+            metrics.inc('delivery_plain_fallbacks')
+            logger.warning(f"Telegram не принял разметку для чата {self.chat_id}, отправляем текст: {e}")
+            await self._put_part(index, to_plain_text(text, parse_mode), None)
+
+    async def _put_part(self, index, text, parse_mode):
+        """Часть index: правка уже отправленного сообщения или новое сообщение"""
+        if index < len(self.message_ids):
+            try:
+                await self._call(
+                    self.bot.edit_message_text,
+                    text,
+                    chat_id=self.chat_id,
+                    message_id=self.message_ids[index],
+                    parse_mode=parse_mode
+                )
+                return
+            except TelegramBadRequest as e:
+                description = str(e)
+                # Текст уже такой (например, после повтора) — это успех
+                if "message is not modified" in description:
+                    return
+                if "can't parse entities" in description:
+                    raise
+                # Сообщение удалено или его нельзя править: отправляем новое
+                logger.debug(f"Не удалось изменить сообщение, отправляем новое: {e}")
+
+            message = await self._call(self.bot.send_message, self.chat_id, text, parse_mode=parse_mode)
+            self.message_ids[index] = message.message_id
+        else:
+            message = await self._call(self.bot.send_message, self.chat_id, text, parse_mode=parse_mode)
+            self.message_ids.append(message.message_id)
+
+    async def _call(self, method, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await method(*args, **kwargs)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                metrics.inc('delivery_retries')
+                logger.warning(f"Ошибка доставки в чат {self.chat_id}, повтор: {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+
+async def fan_out(deliveries, text, parse_mode=None):
+    """Одновременная доставка текста всем получателям.
+
+    Ошибка у одного получателя не мешает остальным; возвращается число
+    успешных доставок.
+    """
+    started_at = time.monotonic()
+    results = await asyncio.gather(
+        *(delivery.deliver(text, parse_mode) for delivery in deliveries),
+        return_exceptions=True
+    )
+
+    delivered = 0
+    for delivery, result in zip(deliveries, results):
+        if isinstance(result, Exception):
+            metrics.inc('delivery_failed')
+            logger.error(f"Не удалось доставить рекомендации в чат {delivery.chat_id}: {result}")
+        else:
+            delivered += 1
+    metrics.observe('delivery_time', time.monotonic() - started_at)
+    return delivered
@@ -0,0 +1,223 @@
+import re
+from datetime import date
+
+# Разбор ответов анкеты: ключевые слова, длительность и годы выпуска
+
+# Ключевые слова предпочтений и шаблоны их словоформ: ключ — каноническое
+# слово, значение — регулярное выражение по основе слова
+KEYWORD_PATTERNS = {
+    # Жанры
+    "комедия": r"комеди\w*|комедийн\w*",
+    "драма": r"драм\w*",
+    "фантастика": r"фантаст\w*|научно-фантастическ\w*",
+    "боевик": r"боевик\w*|экшн",
+    "триллер": r"триллер\w*",
+    "мелодрама": r"мелодрам\w*",
+    "детектив": r"детектив\w*",
+    "ужасы": r"ужас\w*|хоррор\w*",
+    "фэнтези": r"фэнтези|фентези",
+    "приключения": r"приключен\w*",
+    "аниме": r"аниме",
+    "мультфильм": r"мульт\w*|анимаци\w*",
+    "биография": r"биограф\w*",
+    "история": r"истори\w*",
+    "документальный": r"документальн\w*",
+    # Настроение
+    "веселое": r"весел\w*|смешн\w*",
+    "романтическое": r"романти\w*",
+    "грустное": r"грустн\w*|печальн\w*",
+    "напряженное": r"напряженн\w*",
+    "расслабленное": r"расслабл\w*",
+    "вдохновляющее": r"вдохновля\w*",
+    "страшное": r"страшн\w*",
+    "загадочное": r"загадочн\w*",
+}
+
+KEYWORDS = list(KEYWORD_PATTERNS)
+
+# Все шаблоны объединены в одно выражение, поэтому текст просматривается
+# за один проход; номер сработавшей группы указывает на ключевое слово
+KEYWORD_REGEX = re.compile(
+    "|".join(
+        rf"(?P<k{number}>\b(?:{pattern}))"
+        for number, pattern in enumerate(KEYWORD_PATTERNS.values())
+    ),
+    re.IGNORECASE
+)
+
+
+def extract_keywords(answer):
+    """Ключевые слова из ответа с учетом словоформ"""
+    if not answer:
+        return ["универсальный", "популярный"]
+
+    found = set()
+    for match in KEYWORD_REGEX.finditer(answer.lower().replace("ё", "е")):
+        found.add(KEYWORDS[int(match.lastgroup[1:])])
+
+    keywords = [keyword for keyword in KEYWORDS if keyword in found]
+    return keywords if keywords else ["универсальный", "популярный"]
+
+
+# Жанры и настроения в порядке KEYWORD_PATTERNS
+GENRES = KEYWORDS[:15]
+MOODS = KEYWORDS[15:]
+
+# Английские названия жанров во внешних каталогах
+GENRE_ALIASES = {
+    "comedy": "комедия",
+    "drama": "драма",
+    "sci-fi": "фантастика",
+    "science fiction": "фантастика",
+    "action": "боевик",
+    "thriller": "триллер",
+    "romance": "мелодрама",
+    "mystery": "детектив",
+    "crime": "детектив",
+    "horror": "ужасы",
+    "fantasy": "фэнтези",
+    "adventure": "приключения",
+    "anime": "аниме",
+    "animation": "мультфильм",
+    "biography": "биография",
+    "history": "история",
+    "documentary": "документальный",
+}
+
+# Жанры, которые подходят под настроение
+MOOD_GENRES = {
+    "веселое": ["комедия", "мультфильм", "приключения"],
+    "романтическое": ["мелодрама", "драма", "комедия"],
+    "грустное": ["драма", "мелодрама", "биография"],
+    "напряженное": ["триллер", "боевик", "детектив"],
+    "расслабленное": ["комедия", "мультфильм", "приключения"],
+    "вдохновляющее": ["биография", "драма", "документальный"],
+    "страшное": ["ужасы", "триллер"],
+    "загадочное": ["детектив", "триллер", "фантастика"],
+}
+
+# Диапазоны длительности в минутах
+DURATION_RANGES = {
+    "short": (0, 90),
+    "standard": (90, 120),
+    "long": (120, 400),
+}
+
+
+def normalize_genre(name):
+    """Каноническое русское название жанра или None"""
+    name = name.strip().lower().replace("ё", "е")
+    if name in GENRE_ALIASES:
+        return GENRE_ALIASES[name]
+    keywords = extract_keywords(name)
+    for keyword in keywords:
+        if keyword in GENRES:
+            return keyword
+    return None
+
+
+def parse_duration(answer):
+    """Предпочитаемая длительность: (мин, макс) в минутах или None"""
+    if not answer:
+        return None
+    text = answer.lower()
+
+    limit = re.search(r"до\s*(\d{2,3})", text)
+    if limit:
+        return 0, int(limit.group(1))
+    if re.search(r"коротк|до 1,5|полтора", text):
+        return DURATION_RANGES["short"]
+    if re.search(r"длинн|долг|120\s*\+|больше 2|\b3 час", text):
+        return DURATION_RANGES["long"]
+    if re.search(r"стандарт|средн|обычн|90\s*-\s*120|2 час", text):
+        return DURATION_RANGES["standard"]
+    return None
+
+
+def parse_years(answer):
+    """Предпочитаемые годы выпуска: (с, по) или None"""
+    if not answer:
+        return None
+    text = answer.lower()
+    current_year = date.today().year
+
+    years = [int(year) for year in re.findall(r"\b(19\d{2}|20\d{2})\b", text)]
+    if len(years) >= 2:
+        return min(years), max(years)
+    if years:
+        if re.search(r"\+|после|позже|с\s", text):
+            return years[0], current_year
+        if re.search(r"до\s", text):
+            return 1900, years[0]
+        return years[0], years[0]
+
+    if re.search(r"новинк|новые|свеж|последн", text):
+        return current_year - 2, current_year
+
+    # Десятилетия: «90-е», «80-х и 90-х», «классика 70-90х»
+    if re.search(r"(?<!\d)[2-9]0\s*-?\s*(?:х|е|ые|ых)\b", text):
+        decades = [int(decade) for decade in re.findall(r"(?<!\d)([2-9]0)(?!\d)", text)]
+        return 1900 + min(decades), 1900 + max(decades) + 9
+
+    if re.search(r"классик|старые|старое", text):
+        return 1930, 1999
+    if re.search(r"современ|2000", text):
+        return 2000, current_year
+    return None
+
+
+# Битовые маски жанров и настроений в порядке GENRES и MOODS
+GENRE_BITS = {genre: 1 << number for number, genre in enumerate(GENRES)}
+MOOD_BITS = {mood: 1 << number for number, mood in enumerate(MOODS)}
+
+# Пропущенный вопрос
+SKIPPED_ANSWER = "не указано"
+
+
+def empty_features():
+    """Признаки анкеты пользователя до первого ответа.
+
+    genres и moods — битовые маски, duration и years — диапазоны [с, по]
+    или None, favorites — фильмы каталога парами [ID, название].
+    """
+    return {"genres": 0, "moods": 0, "duration": None, "years": None, "favorites": []}
+
+
+def update_features(features, question_key, answer, resolve_titles=None):
+    """Новая запись признаков с учетом ответа на вопрос question_key"""
+    features = dict(features or empty_features())
+    if not answer or answer.strip().lower() == SKIPPED_ANSWER:
+        return features
+
+    if question_key in ("genre", "mood"):
+        # Жанры и настроение в ответах часто перемешаны, учитываем оба
+        for keyword in extract_keywords(answer):
+            if keyword in GENRE_BITS:
+                features["genres"] |= GENRE_BITS[keyword]
+            elif keyword in MOOD_BITS:
+                features["moods"] |= MOOD_BITS[keyword]
+    elif question_key == "duration":
+        duration = parse_duration(answer)
+        features["duration"] = list(duration) if duration else None
+    elif question_key == "year":
+        years = parse_years(answer)
+        features["years"] = list(years) if years else None
+    elif question_key == "favorite_movies" and resolve_titles is not None:
+        features["favorites"] = resolve_titles(answer)
+    return features
+
+
+def features_from_answers(answers, resolve_titles=None):
+    """Признаки по уже собранным ответам (для старых сессий без признаков)"""
+    features = empty_features()
+    for question_key, answer in answers.items():
+        features = update_features(features, question_key, answer, resolve_titles)
+    return features
+
+
+def genres_from_mask(mask):
+    return [genre for genre, bit in GENRE_BITS.items() if mask & bit]
+
+
+def moods_from_mask(mask):
+    return [mood for mood, bit in MOOD_BITS.items() if mask & bit]
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationQueue:
+    """Очередь генерации рекомендаций поверх таблицы generation_jobs.
+
+    Обработчик сообщений только ставит задание (см. Database.claim_completion),
+    а генерацию выполняют workers исполнителей этого процесса. Задание
+    берется в аренду на lease_seconds, и аренда продлевается, пока задание
+    выполняется; если процесс упал, после истечения аренды задание заберет
+    другой исполнитель или тот же бот после перезапуска. Если аренду
+    продлить не удалось и задание может достаться другому исполнителю,
+    обработчик отменяется, чтобы рекомендации не отправились дважды. Ошибка ведет к
+    повтору с экспоненциальной паузой, после max_attempts попыток задание
+    и его сессия помечаются 'failed', и вызывается on_failure(session_id).
+    """
+
+    def __init__(self, db, handler, workers=4, lease_seconds=30, max_attempts=3,
+                 retry_delay=5, poll_interval=2, on_failure=None):
+        self.db = db
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.wakeup = None
+        self.tasks = []
+
+    async def start(self):
+        if self.tasks:
+            return
+        self.wakeup = asyncio.Event()
+
+        # Сессии, генерация которых прервалась до появления очереди
+        requeued = await self.db.requeue_generating_sessions(time.time())
+        if requeued:
+            logger.info(f"Возобновлено прерванных генераций: {requeued}")
+
+        self.tasks = [asyncio.create_task(self._worker(f"{os.getpid()}:{number}"))
+                      for number in range(self.workers)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def notify(self):
+        """Новое задание в очереди: будим исполнителей, не дожидаясь опроса"""
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _worker(self, owner):
+        while True:
+            try:
+                job = await self.db.claim_generation_job(owner, time.time(), self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Не удалось получить задание генерации: {e}")
+                job = None
+
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(owner, *job)
+
+    async def _run(self, owner, job_id, session_id, attempts, enqueued_at):
+        if attempts == 1:
+            metrics.observe('generation_job_wait', time.time() - enqueued_at)
+        handler = asyncio.create_task(self.handler(session_id))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, owner, handler))
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled():
+                # Аренду потерял этот исполнитель; заданием распоряжается новый
+                metrics.inc('generation_jobs_lease_lost')
+                return
+            # Остановка бота: задание вернется в очередь без штрафной попытки
+            await self.db.retry_generation_job(job_id, owner, time.time(), 'прервано остановкой',
+                                               count_attempt=False)
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка задания генерации {session_id} (попытка {attempts}): {e}")
+            if attempts >= self.max_attempts:
+                metrics.inc('generation_jobs_failed')
+                if await self.db.finish_generation_job(job_id, owner, time.time(), 'failed', str(e)):
+                    await self._notify_failure(session_id)
+            else:
+                metrics.inc('generation_jobs_retried')
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                await self.db.retry_generation_job(job_id, owner, time.time() + delay, str(e))
+        else:
+            metrics.inc('generation_jobs_done')
+            await self.db.finish_generation_job(job_id, owner, time.time())
+        finally:
+            heartbeat.cancel()
+
+    async def _notify_failure(self, session_id):
+        if self.on_failure is None:
+            return
+        try:
+            await self.on_failure(session_id)
+        except Exception as e:
+            logger.error(f"Ошибка обработки неудачного задания {session_id}: {e}")
+
+    async def _heartbeat(self, job_id, owner, handler):
+        """Продление аренды; при ее потере отменяет handler и завершается"""
+        lease_until = time.time() + self.lease_seconds
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            next_lease_until = time.time() + self.lease_seconds
+            try:
+                extended = await self.db.extend_generation_job(job_id, owner, next_lease_until)
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задания {job_id}: {e}")
+                # Пока аренда действует, задание никто другой не заберет;
+                # отменяем заранее, если она истечет до следующей попытки
+                extended = time.time() + self.lease_seconds / 3 < lease_until
+            else:
+                if extended:
+                    lease_until = next_lease_until
+            if not extended:
+                logger.warning(f"Аренда задания {job_id} потеряна, генерация отменена")
+                handler.cancel()
+                return
@@ -0,0 +1,123 @@
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: меньше — важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class LLMQueueFull(Exception):
+    """Очередь запросов к LLM переполнена"""
+
+
+class LLMDispatcher:
+    """Диспетчер запросов к LLM.
+
+    Блокирующие вызовы SDK выполняются в собственном ограниченном пуле
+    потоков, а не в общем executor'е asyncio. Ожидающие запросы стоят в
+    приоритетной очереди ограниченной длины; при переполнении запрос сразу
+    отклоняется (backpressure). Одинаковые запросы, уже находящиеся в работе,
+    не дублируются: вызывающие получают общий результат (single-flight).
+    Если все ожидающие запрос отменены, он снимается с очереди и сразу
+    перестает учитываться в ее длине; уже начатый вызов SDK прервать
+    нельзя, его результат просто отбрасывается.
+    """
+
+    def __init__(self, max_workers=4, max_queue=100, name='llm'):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.queue = None
+        self.workers = []
+        self.in_flight = {}
+        self.waiters = {}
+        # Запросы в очереди, которые еще кто-то ждет; отмененные остаются
+        # в PriorityQueue до выборки, но в backpressure не считаются
+        self.queued = set()
+        self.sequence = itertools.count()
+
+    async def start(self):
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+        self.queue = None
+        self.queued = set()
+        self.executor.shutdown(wait=False)
+
+    def queue_depth(self):
+        return len(self.queued)
+
+    async def submit(self, func, *args, priority=PRIORITY_INTERACTIVE, dedup_key=None):
+        """Выполнить func(*args) в пуле LLM и дождаться результата"""
+        await self.start()
+
+        shared = self.in_flight.get(dedup_key) if dedup_key is not None else None
+        if shared is not None and not shared.done():
+            metrics.inc(f'{self.name}_coalesced')
+            return await self._wait(shared)
+
+        if len(self.queued) >= self.max_queue:
+            metrics.inc(f'{self.name}_rejected')
+            raise LLMQueueFull(f"В очереди {self.name} уже {len(self.queued)} запросов")
+
+        future = asyncio.get_running_loop().create_future()
+        if dedup_key is not None:
+            self.in_flight[dedup_key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(dedup_key, None))
+
+        self.queue.put_nowait((priority, next(self.sequence), time.monotonic(), func, args, future))
+        self.queued.add(future)
+        metrics.set_gauge(f'{self.name}_queue_depth', len(self.queued))
+
+        return await self._wait(future)
+
+    async def _wait(self, future):
+        """Ожидание результата; с уходом последнего ожидающего запрос отменяется"""
+        self.waiters[future] = self.waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.waiters[future] -= 1
+            if not self.waiters[future]:
+                del self.waiters[future]
+                if not future.done():
+                    metrics.inc(f'{self.name}_cancelled')
+                    self.queued.discard(future)
+                    metrics.set_gauge(f'{self.name}_queue_depth', len(self.queued))
+                    future.cancel()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, enqueued_at, func, args, future = await self.queue.get()
+            metrics.observe(f'{self.name}_queue_wait', time.monotonic() - enqueued_at)
+            self.queued.discard(future)
+            metrics.set_gauge(f'{self.name}_queue_depth', len(self.queued))
+
+            if future.done():
+                continue
+
+            started_at = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self.executor, func, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                metrics.observe(f'{self.name}_call_time', time.monotonic() - started_at)
@@ -0,0 +1,61 @@
+import threading
+
+# Простые внутрипроцессные метрики: счетчики, текущие значения и тайминги.
+# Смотреть их можно командой /stats (доступна администраторам).
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def inc(name, value=1):
+    """Увеличить счетчик"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Установить текущее значение показателя"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """Учесть длительность операции в секундах"""
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    """Копия всех метрик на текущий момент"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': dict(_timings),
+        }
+
+
+def format_report():
+    """Текстовый отчет по метрикам для отправки в чат"""
+    data = snapshot()
+    lines = ["📈 Метрики бота\n"]
+
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name}: {value}")
+    for name, value in sorted(data['gauges'].items()):
+        lines.append(f"{name}: {value}")
+    for name, (count, total, maximum) in sorted(data['timings'].items()):
+        average = total / count if count else 0.0
+        lines.append(f"{name}: n={count} avg={average:.3f}s max={maximum:.3f}s")
+
+    if len(lines) == 1:
+        lines.append("Пока нет данных")
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+# Поля анкеты в порядке вопросов
+ANSWER_FIELDS = ("genre", "favorite_movies", "mood", "duration", "year", "additional")
+
+# Ответы, которые означают отсутствие предпочтений
+EMPTY_ANSWERS = {"", "не указано", "нет", "-"}
+
+# Признаки из записи features, входящие в ключ кэша
+FEATURE_FIELDS = ("genres", "moods", "duration", "years", "favorites")
+
+
+def normalize_answers(answers):
+    """Приведение ответов к каноническому виду: регистр, пробелы, пропуски"""
+    normalized = []
+    for field in ANSWER_FIELDS:
+        value = ' '.join(str(answers.get(field) or '').lower().split())
+        normalized.append('' if value in EMPTY_ANSWERS else value)
+    return tuple(normalized)
+
+
+def cache_fields(answers, features=None):
+    """Поля ключа кэша для одного пользователя.
+
+    Нормализованные ответы входят в ключ всегда: их формулировки попадают
+    в промпт, поэтому пары с разными текстами не получат один ответ Gemini.
+    С записью признаков к ним добавляются извлеченные признаки, в том числе
+    любимые фильмы, сопоставленные с каталогом.
+    """
+    fields = list(normalize_answers(answers))
+    if features is not None:
+        fields.extend(features[field] for field in FEATURE_FIELDS)
+    return fields
+
+
+def make_cache_key(user1_answers, user2_answers, variant='', features=None):
+    """Ключ кэша, не зависящий от того, кто из пары первый пользователь.
+
+    variant отделяет записи разных форматов ответа (например, HTML и Markdown),
+    features — пара записей признаков пользователей (см. cache_fields).
+    """
+    features1, features2 = features or (None, None)
+    pair = sorted(
+        json.dumps(fields, ensure_ascii=False, separators=(',', ':'))
+        for fields in (cache_fields(user1_answers, features1), cache_fields(user2_answers, features2))
+    )
+    payload = json.dumps([variant, pair], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RecommendationCache:
+    """Кэш рекомендаций: LRU+TTL в памяти поверх таблицы в SQLite"""
+
+    def __init__(self, db, max_size=1000, ttl=7 * 24 * 3600):
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, key):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, recommendations = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                metrics.inc('recommendation_cache_hits')
+                return recommendations
+            del self.entries[key]
+
+        row = await self.db.get_cached_recommendation(key, int(now))
+        if row is not None:
+            recommendations, expires_at = row
+            self._remember(key, expires_at, recommendations)
+            metrics.inc('recommendation_cache_hits')
+            return recommendations
+
+        metrics.inc('recommendation_cache_misses')
+        return None
+
+    async def put(self, key, recommendations):
+        expires_at = int(time.time() + self.ttl)
+        self._remember(key, expires_at, recommendations)
+        await self.db.save_cached_recommendation(key, recommendations, expires_at)
+
+    def _remember(self, key, expires_at, recommendations):
+        self.entries[key] = (expires_at, recommendations)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
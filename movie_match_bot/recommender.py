@@ -0,0 +1,148 @@
+import numpy as np
+
+from features import GENRES, MOOD_GENRES, genres_from_mask, moods_from_mask
+
+GENRE_POSITIONS = {genre: number for number, genre in enumerate(GENRES)}
+
+# Вклад признаков в оценку фильма для одного пользователя
+GENRE_WEIGHT = 0.55
+DURATION_WEIGHT = 0.15
+YEAR_WEIGHT = 0.15
+RATING_WEIGHT = 0.15
+
+# Оценка признака, о котором пользователь ничего не сказал
+NEUTRAL_SCORE = 0.5
+
+# Вес жанров любимых фильмов пользователя
+FAVORITE_GENRE_WEIGHT = 0.7
+
+
+class LocalRecommender:
+    """Локальный подбор фильмов по каталогу без обращения к LLM.
+
+    Каждый фильм оценивается для каждого пользователя векторно по всему
+    каталогу сразу: жанры и настроение, длительность, годы, рейтинг.
+    Итоговая оценка пары — минимум или среднее гармоническое двух оценок,
+    чтобы наверх попадали фильмы, которые понравятся обоим.
+    Работает по записям признаков, собранным в момент ответа, и ответы
+    заново не разбирает. Любимые фильмы из записи добавляют свои жанры
+    к предпочтениям и сами в подборку не попадают.
+    """
+
+    def __init__(self, catalog, objective='harmonic', title_index=None):
+        self.catalog = catalog
+        self.objective = objective
+        self.title_index = title_index
+
+        # Колонки каталога не копируются (они могут быть отображены в память),
+        # заранее считаются только небольшие производные массивы
+        genre_counts = np.zeros(len(catalog), dtype=np.float32)
+        for position in range(len(GENRES)):
+            genre_counts += (catalog.genre_masks >> position) & 1
+        self.genre_norms = np.sqrt(np.maximum(genre_counts, 1))
+        self.rating_scores = np.clip((catalog.ratings.astype(np.float32) - 5) / 5, 0, 1)
+
+    def favorite_ids(self, favorites):
+        """Строки каталога для любимых фильмов из записи признаков.
+
+        Фильмы хранятся парами [ID, название]. После пересборки каталога ID
+        может указывать на другой фильм или выйти за его пределы; такие
+        записи отбрасываются.
+        """
+        movie_ids = []
+        for entry in favorites:
+            if not isinstance(entry, (list, tuple)) or len(entry) != 2:
+                continue
+            movie_id, title = entry
+            if 0 <= movie_id < len(self.catalog) and self.catalog.titles[movie_id] == title:
+                movie_ids.append(movie_id)
+        return movie_ids
+
+    def preference_vector(self, features):
+        """Веса жанров пользователя с учетом настроения и любимых фильмов"""
+        weights = np.zeros(len(GENRES), dtype=np.float32)
+        for movie_id in self.favorite_ids(features["favorites"]):
+            mask = int(self.catalog.genre_masks[movie_id])
+            for position in range(len(GENRES)):
+                if mask >> position & 1:
+                    weights[position] = FAVORITE_GENRE_WEIGHT
+
+        for mood in moods_from_mask(features["moods"]):
+            for genre in MOOD_GENRES.get(mood, ()):
+                position = GENRE_POSITIONS[genre]
+                weights[position] = max(weights[position], 0.5)
+        for genre in genres_from_mask(features["genres"]):
+            weights[GENRE_POSITIONS[genre]] = 1.0
+        return weights
+
+    def score_user(self, features):
+        """Оценки всех фильмов каталога для одного пользователя (0..1)"""
+        weights = self.preference_vector(features)
+        if weights.any():
+            genre_scores = np.zeros(len(self.catalog), dtype=np.float32)
+            for position in np.flatnonzero(weights):
+                genre_scores += ((self.catalog.genre_masks >> position) & 1) * weights[position]
+            genre_scores /= self.genre_norms * np.linalg.norm(weights)
+        else:
+            genre_scores = NEUTRAL_SCORE
+
+        duration_scores = self._range_scores(self.catalog.runtimes, features["duration"], 30.0)
+        year_scores = self._range_scores(self.catalog.years, features["years"], 10.0)
+
+        return (
+            GENRE_WEIGHT * genre_scores
+            + DURATION_WEIGHT * duration_scores
+            + YEAR_WEIGHT * year_scores
+            + RATING_WEIGHT * self.rating_scores
+        )
+
+    @staticmethod
+    def _range_scores(values, bounds, scale):
+        """1 внутри диапазона, экспоненциальное затухание снаружи"""
+        if bounds is None:
+            return NEUTRAL_SCORE
+        low, high = bounds
+        values = values.astype(np.float32)
+        distance = np.maximum(np.maximum(low - values, values - high), 0)
+        scores = np.exp(-distance / scale)
+        # Неизвестное значение в каталоге не штрафуем и не поощряем
+        return np.where(values > 0, scores, NEUTRAL_SCORE)
+
+    def joint_scores(self, features1, features2):
+        scores1 = self.score_user(features1)
+        scores2 = self.score_user(features2)
+        if self.objective == 'min':
+            return np.minimum(scores1, scores2)
+        return 2 * scores1 * scores2 / np.maximum(scores1 + scores2, 1e-9)
+
+    def recommend(self, features1, features2, k=6):
+        """Топ-k фильмов для пары по записям признаков (features.empty_features)"""
+        if len(self.catalog) == 0:
+            return []
+
+        scores = self.joint_scores(features1, features2)
+
+        # Уже любимые фильмы не предлагаем
+        seen = sorted(
+            set(self.favorite_ids(features1["favorites"])) | set(self.favorite_ids(features2["favorites"]))
+        )
+        scores[seen] = -1.0
+
+        k = min(k, len(scores) - len(seen))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        common = set(genres_from_mask(features1["genres"] & features2["genres"]))
+
+        films = []
+        for index in top:
+            film = self.catalog.movie(int(index))
+            shared = [genre for genre in film["genres"] if genre in common]
+            if shared:
+                film["reason"] = "Оба любите: " + ", ".join(shared)
+            else:
+                film["reason"] = f"Хороший компромисс для вашей пары (совпадение {scores[index]:.0%})"
+            films.append(film)
+        return films
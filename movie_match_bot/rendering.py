@@ -0,0 +1,220 @@
+import html
+import json
+import re
+
+# Заголовок подборки, общий для всех способов отображения
+RECOMMENDATIONS_TITLE = "🎬 ВАША ПЕРСОНАЛЬНАЯ ПОДБОРКА ФИЛЬМОВ 🍿"
+
+# Лимит длины текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+_decoder = json.JSONDecoder()
+
+
+def _strip_code_fence(text):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text
+
+
+def parse_films(text):
+    """Разбор ответа Gemini в формате {"films": [...]}; None, если это не JSON"""
+    text = _strip_code_fence(text)
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    try:
+        data, _ = _decoder.raw_decode(text, start)
+    except ValueError:
+        return None
+
+    films = data.get("films") if isinstance(data, dict) else None
+    if not isinstance(films, list):
+        return None
+    return [film for film in films if isinstance(film, dict) and film.get("title")]
+
+
+def parse_partial_films(text):
+    """Фильмы, полностью полученные к текущему моменту потоковой генерации"""
+    films_start = text.find('"films"')
+    if films_start == -1:
+        return []
+    position = text.find("[", films_start)
+    if position == -1:
+        return []
+
+    films = []
+    position += 1
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        try:
+            film, position = _decoder.raw_decode(text, position)
+        except ValueError:
+            break
+        if isinstance(film, dict) and film.get("title"):
+            films.append(film)
+    return films
+
+
+def _format_film(number, film):
+    title = html.escape(str(film.get("title", "")))
+    year = film.get("year")
+    genres = film.get("genres") or []
+    if isinstance(genres, str):
+        genres = [genres]
+    rating = film.get("rating")
+    reason = film.get("reason")
+
+    lines = [f"{number}. <b>{title}</b>" + (f" ({html.escape(str(year))})" if year else "")]
+
+    details = []
+    if genres:
+        details.append("🎭 " + html.escape(", ".join(str(genre) for genre in genres)))
+    if rating:
+        details.append(f"⭐ {html.escape(str(rating))}")
+    if details:
+        lines.append(" | ".join(details))
+
+    if reason:
+        lines.append(f"❤️ {html.escape(str(reason))}")
+    return "\n".join(lines)
+
+
+def render_films_html(films, max_length=MAX_MESSAGE_LENGTH):
+    """Безопасный HTML для Telegram; лишние фильмы отбрасываются по лимиту длины"""
+    text = f"<b>{RECOMMENDATIONS_TITLE}</b>"
+    for number, film in enumerate(films, 1):
+        block = "\n\n" + _format_film(number, film)
+        if len(text) + len(block) > max_length:
+            break
+        text += block
+    return text
+
+
+def render_films_markdown(films, max_length=MAX_MESSAGE_LENGTH):
+    """Текст для parse_mode='Markdown' со экранированными спецсимволами"""
+    def escape(value):
+        value = str(value)
+        for char in ("\\", "_", "*", "`", "["):
+            value = value.replace(char, "\\" + char)
+        return value
+
+    text = f"*{RECOMMENDATIONS_TITLE}*"
+    for number, film in enumerate(films, 1):
+        genres = film.get("genres") or []
+        if isinstance(genres, str):
+            genres = [genres]
+
+        block = f"\n\n{number}. *{escape(film.get('title', ''))}*"
+        if film.get("year"):
+            block += f" ({escape(film['year'])})"
+        details = []
+        if genres:
+            details.append("🎭 " + escape(", ".join(str(genre) for genre in genres)))
+        if film.get("rating"):
+            details.append(f"⭐ {escape(film['rating'])}")
+        if details:
+            block += "\n" + " | ".join(details)
+        if film.get("reason"):
+            block += f"\n❤️ {escape(film['reason'])}"
+
+        if len(text) + len(block) > max_length:
+            break
+        text += block
+    return text
+
+
+def escape_plain_text(text):
+    """Обычный текст для отправки с parse_mode='HTML'"""
+    return html.escape(text, quote=False)
+
+
+# Теги и сущности HTML, которые нельзя разрезать между сообщениями
+HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+HTML_ENTITY = re.compile(r"&#?\w+;")
+
+
+def _find_cut(text, max_length):
+    """Место разреза: по абзацу, затем по строке и пробелу, в крайнем случае по символу"""
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, 0, max_length + 1)
+        # Слишком короткие части не нужны, лучше резать по следующему разделителю
+        if cut > max_length // 2:
+            return cut
+    return max(max_length, 1)
+
+
+def _safe_html_cut(text, cut):
+    """Сдвиг разреза назад, если он попал внутрь тега или сущности"""
+    tag_start = text.rfind("<", 0, cut)
+    if tag_start > text.rfind(">", 0, cut):
+        cut = tag_start
+    entity_start = text.rfind("&", 0, cut)
+    if entity_start != -1:
+        entity = HTML_ENTITY.match(text, entity_start)
+        if entity and entity.end() > cut:
+            cut = entity_start
+    return cut
+
+
+def _open_html_tags(text):
+    """Теги, открытые в конце text: [(имя, открывающий тег)]"""
+    open_tags = []
+    for match in HTML_TAG.finditer(text):
+        closing, name = match.group(1), match.group(2).lower()
+        if not closing:
+            open_tags.append((name, match.group(0)))
+            continue
+        for position in range(len(open_tags) - 1, -1, -1):
+            if open_tags[position][0] == name:
+                del open_tags[position:]
+                break
+    return open_tags
+
+
+def split_message(text, max_length=MAX_MESSAGE_LENGTH, parse_mode=None):
+    """Разбиение длинного текста на сообщения не длиннее max_length.
+
+    Режем по абзацам, затем по строкам и пробелам, в крайнем случае по
+    символам. В HTML разрез не попадает внутрь тега или сущности, а теги,
+    открытые на месте разреза, закрываются в конце части и открываются
+    заново в начале следующей, так что каждая часть — корректная разметка.
+    """
+    text = text.strip()
+    parts = []
+    reopen = ""
+    while len(reopen) + len(text) > max_length:
+        budget = max_length - len(reopen)
+        while True:
+            cut = _find_cut(text, budget)
+            open_tags = []
+            closing = ""
+            if parse_mode == 'HTML':
+                # Если текст начинается с длинного тега, режем как есть
+                cut = _safe_html_cut(text, cut) or cut
+                open_tags = _open_html_tags(reopen + text[:cut])
+                closing = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+            part = reopen + text[:cut].rstrip() + closing
+            if len(part) <= max_length or budget <= 1:
+                break
+            # Закрывающие теги не поместились: уменьшаем часть на их длину
+            budget -= len(part) - max_length
+
+        parts.append(part)
+        reopen = "".join(tag for _, tag in open_tags)
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(reopen + text)
+    return parts
+
+
+def to_plain_text(text, parse_mode):
+    """Текст без разметки для повторной отправки, если Telegram ее не принял"""
+    if parse_mode == 'HTML':
+        return html.unescape(re.sub(r"<[^>]+>", "", text))
+    return text
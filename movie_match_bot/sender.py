@@ -0,0 +1,280 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений: меньше — важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Приоритет запросов, отправленных из текущей задачи (см. send_priority)
+_current_priority = contextvars.ContextVar('send_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority):
+    """Все запросы к Bot API внутри блока идут с заданным приоритетом"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # До этого момента ведро заблокировано (retry-after от Telegram)
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 — уже доступен)"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API.
+
+    Подключается как middleware сессии бота, поэтому через него проходят
+    все send_message, edit_message_text, message.answer и т.п. Запросы
+    с chat_id ставятся в приоритетную очередь и отправляются с учетом
+    общего лимита (global_rate в секунду) и лимита на чат (chat_rate),
+    по одному запросу на чат одновременно, чтобы сообщения не
+    переставлялись. На TelegramRetryAfter чат блокируется на указанное
+    время, а запрос повторяется до max_retries раз. Остальные методы
+    (getUpdates, getMe, ...) идут напрямую.
+
+    Запросы каждого чата лежат в его куче по (приоритет, номер). Чаты,
+    которым есть что отправить, стоят в куче готовых — по первому запросу —
+    или в куче ждущих своего лимита — по времени готовности. Выбор
+    следующего запроса стоит O(log n), поэтому всплеск из сотен массовых
+    уведомлений не замедляет отправку.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3, idle_chat_ttl=60):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.idle_chat_ttl = idle_chat_ttl
+        self.chat_buckets = {}
+        self.busy_chats = set()
+        self.chat_queues = {}
+        # Ключ (приоритет, номер), под которым чат стоит в ready/waiting;
+        # записи куч с другим ключом устарели и пропускаются
+        self.scheduled = {}
+        self.ready = []
+        self.waiting = []
+        self.size = 0
+        self.sending = set()
+        self.sequence = itertools.count()
+        self.swept_at = time.monotonic()
+        self.wakeup = None
+        self.dispatcher_task = None
+
+    def __len__(self):
+        return self.size
+
+    async def start(self):
+        if self.dispatcher_task is None:
+            self.wakeup = asyncio.Event()
+            self.dispatcher_task = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        if self.dispatcher_task is not None:
+            self.dispatcher_task.cancel()
+            self.dispatcher_task = None
+        for queue in self.chat_queues.values():
+            for *_, future in queue:
+                if not future.done():
+                    future.cancel()
+        self.chat_queues = {}
+        self.scheduled = {}
+        self.ready = []
+        self.waiting = []
+        self.size = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_current_priority.get(), next(self.sequence), time.monotonic(),
+                      chat_id, make_request, bot, method, 0, future)
+        return await future
+
+    def _enqueue(self, priority, sequence, enqueued_at, chat_id, make_request, bot, method, attempt, future):
+        queue = self.chat_queues.setdefault(chat_id, [])
+        # Номера уникальны, поэтому элементы сравниваются только по (приоритет, номер)
+        heapq.heappush(queue, (priority, sequence, enqueued_at, chat_id, make_request, bot, method, attempt, future))
+        self.size += 1
+        metrics.set_gauge('send_queue_depth', self.size)
+        self._schedule(chat_id, time.monotonic())
+        self.wakeup.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _schedule(self, chat_id, now):
+        """Постановка свободного чата в кучу готовых или ждущих по его первому запросу"""
+        queue = self.chat_queues.get(chat_id)
+        if not queue or chat_id in self.busy_chats:
+            return
+        key = queue[0][:2]
+        scheduled = self.scheduled.get(chat_id)
+        if scheduled is not None and scheduled <= key:
+            return
+
+        self.scheduled[chat_id] = key
+        delay = self._chat_bucket(chat_id).delay(now)
+        if delay <= 0:
+            heapq.heappush(self.ready, (*key, chat_id))
+        else:
+            heapq.heappush(self.waiting, (now + delay, *key, chat_id))
+
+    def _next_ready(self, now):
+        """Чат с самым приоритетным запросом, который можно отправить сейчас,
+        или время ожидания до ближайшего такого чата"""
+        while self.waiting and self.waiting[0][0] <= now:
+            _, priority, sequence, chat_id = heapq.heappop(self.waiting)
+            if self.scheduled.get(chat_id) == (priority, sequence):
+                heapq.heappush(self.ready, (priority, sequence, chat_id))
+
+        # Порядок (приоритет, номер) сохраняет очередность сообщений внутри чата
+        while self.ready:
+            priority, sequence, chat_id = self.ready[0]
+            if self.scheduled.get(chat_id) != (priority, sequence):
+                heapq.heappop(self.ready)
+                continue
+            delay = self._chat_bucket(chat_id).delay(now)
+            if delay > 0:
+                # Чат заблокирован retry-after уже после постановки в очередь
+                heapq.heappop(self.ready)
+                heapq.heappush(self.waiting, (now + delay, priority, sequence, chat_id))
+                continue
+            return chat_id, 0.0
+
+        return None, (self.waiting[0][0] - now if self.waiting else None)
+
+    def _pop_request(self, chat_id):
+        heapq.heappop(self.ready)
+        del self.scheduled[chat_id]
+        queue = self.chat_queues[chat_id]
+        item = heapq.heappop(queue)
+        if not queue:
+            del self.chat_queues[chat_id]
+        self.size -= 1
+        metrics.set_gauge('send_queue_depth', self.size)
+        return item
+
+    async def _dispatch(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            chat_id, wait = self._next_ready(now)
+
+            if chat_id is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = self.chat_queues[chat_id][0]
+            if item[-1].done():
+                # Вызывающий уже не ждет ответа: лимиты на запрос не тратим
+                self._pop_request(chat_id)
+                self._schedule(chat_id, now)
+                continue
+
+            global_delay = self.global_bucket.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            item = self._pop_request(chat_id)
+            self.global_bucket.consume(now)
+            self._chat_bucket(chat_id).consume(now)
+            self.busy_chats.add(chat_id)
+            task = asyncio.create_task(self._send(item))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+            self._forget_idle_chats(now)
+
+    async def _send(self, item):
+        priority, sequence, enqueued_at, chat_id, make_request, bot, method, attempt, future = item
+        if attempt == 0:
+            metrics.observe('send_queue_wait', time.monotonic() - enqueued_at)
+
+        try:
+            if future.done():
+                return
+            result = await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            metrics.inc('send_retry_after')
+            self._chat_bucket(chat_id).block(time.monotonic(), e.retry_after)
+            if attempt < self.max_retries and not future.done():
+                logger.warning(f"Лимит Telegram для чата {chat_id}, повтор через {e.retry_after} с")
+                self._enqueue(priority, sequence, enqueued_at, chat_id, make_request, bot, method,
+                              attempt + 1, future)
+            elif not future.done():
+                metrics.inc('send_failed')
+                future.set_exception(e)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            metrics.inc('send_completed')
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.busy_chats.discard(chat_id)
+            self._schedule(chat_id, time.monotonic())
+            self.wakeup.set()
+
+    def _forget_idle_chats(self, now):
+        """Полные и давно не использованные ведра чатов не нужны.
+
+        Проход по всем ведрам делается не чаще раза в idle_chat_ttl секунд.
+        """
+        if len(self.chat_buckets) < 1000 or now - self.swept_at < self.idle_chat_ttl:
+            return
+        self.swept_at = now
+        active = set(self.chat_queues) | self.busy_chats
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if chat_id not in active and now - bucket.updated_at > self.idle_chat_ttl:
+                del self.chat_buckets[chat_id]
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeGenerator:
+    """Генерация рекомендаций до того, как пара ответит на последний вопрос.
+
+    Когда оба партнера ответили на все вопросы, кроме последнего,
+    генерация запускается в фоне по уже известным ответам. Когда приходят
+    окончательные ответы, результат используется, только если промпт по
+    ним совпадает с промптом спекулятивного запуска; иначе он отменяется.
+    """
+
+    def __init__(self, generate, make_prompt, max_age=3600):
+        self.generate = generate
+        self.make_prompt = make_prompt
+        self.max_age = max_age
+        self.partial_answers = {}
+        self.offered_at = {}
+        self.running = {}
+
+    def __len__(self):
+        return len(self.running)
+
+    def offer(self, session_code, user_id, answers, user_ids):
+        """Частичные ответы пользователя; запускает генерацию, когда есть у обоих"""
+        self._drop_stale()
+
+        session_answers = self.partial_answers.setdefault(session_code, {})
+        session_answers[user_id] = dict(answers)
+        self.offered_at.setdefault(session_code, time.monotonic())
+
+        if session_code in self.running or not all(uid in session_answers for uid in user_ids):
+            return False
+
+        user1_answers = session_answers[user_ids[0]]
+        user2_answers = session_answers[user_ids[1]]
+        prompt = self.make_prompt(user1_answers, user2_answers)
+        task = asyncio.create_task(self.generate(user1_answers, user2_answers))
+        self.running[session_code] = (prompt, task, time.monotonic())
+        metrics.inc('speculation_started')
+        logger.info(f"Спекулятивная генерация для сессии {session_code}")
+        return True
+
+    def take(self, session_code, user1_answers, user2_answers):
+        """Задача спекулятивной генерации, если она подходит к окончательным ответам"""
+        self.partial_answers.pop(session_code, None)
+        self.offered_at.pop(session_code, None)
+        running = self.running.pop(session_code, None)
+        if running is None:
+            return None
+
+        prompt, task, started_at = running
+        if prompt != self.make_prompt(user1_answers, user2_answers):
+            task.cancel()
+            metrics.inc('speculation_misses')
+            return None
+
+        metrics.inc('speculation_hits')
+        # Сэкономлено столько, сколько генерация уже успела проработать
+        metrics.observe('speculation_saved', time.monotonic() - started_at)
+        return task
+
+    def discard(self, session_code):
+        self.partial_answers.pop(session_code, None)
+        self.offered_at.pop(session_code, None)
+        running = self.running.pop(session_code, None)
+        if running is not None:
+            running[1].cancel()
+
+    def _drop_stale(self):
+        deadline = time.monotonic() - self.max_age
+        for session_code, offered_at in list(self.offered_at.items()):
+            if offered_at < deadline:
+                self.discard(session_code)
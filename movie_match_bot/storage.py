@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_key(key: StorageKey) -> str:
+    """Компактное строковое представление ключа FSM"""
+    thread_id = '' if key.thread_id is None else key.thread_id
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+
+def parse_key(value: str) -> StorageKey:
+    bot_id, chat_id, user_id, thread_id, destiny = value.split(':', 4)
+    return StorageKey(
+        bot_id=int(bot_id),
+        chat_id=int(chat_id),
+        user_id=int(user_id),
+        thread_id=int(thread_id) if thread_id else None,
+        destiny=destiny
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в той же базе SQLite, что и сессии.
+
+    Чтения обслуживаются из ограниченного LRU-кэша, изменения копятся в
+    памяти и раз в flush_interval секунд записываются одной транзакцией
+    (write-behind). При flush_interval = 0 каждая запись идет сразу в БД.
+    """
+
+    def __init__(self, db, flush_interval=0.5, cache_size=10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.flush_task = None
+
+    async def start(self):
+        if self.flush_interval > 0 and self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Запись всех накопленных изменений одной транзакцией"""
+        if not self.dirty:
+            return
+
+        pending, self.dirty = self.dirty, {}
+        upserts = []
+        deletes = []
+        for key_str, (state, data) in pending.items():
+            if state is None and not data:
+                deletes.append(key_str)
+            else:
+                upserts.append((key_str, state, json.dumps(data, ensure_ascii=False, separators=(',', ':'))))
+
+        try:
+            await self.db.save_fsm_records(upserts, deletes)
+        except Exception:
+            # Возвращаем изменения в очередь, не затирая более свежие
+            for key_str, record in pending.items():
+                self.dirty.setdefault(key_str, record)
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояния FSM: {e}")
+
+    async def _load(self, key_str):
+        record = self.dirty.get(key_str)
+        if record is None:
+            record = self.cache.get(key_str)
+        if record is None:
+            row = await self.db.load_fsm_record(key_str)
+            record = (row[0], json.loads(row[1])) if row else (None, {})
+
+        self._remember(key_str, record)
+        return record
+
+    def _remember(self, key_str, record):
+        self.cache[key_str] = record
+        self.cache.move_to_end(key_str)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def _store(self, key_str, record):
+        self._remember(key_str, record)
+        self.dirty[key_str] = record
+        if self.flush_task is None:
+            await self.flush()
+
+    # Счетчики fsm_reads/fsm_writes вместе с messages_received показывают
+    # число обращений к хранилищу на одно сообщение
+
+    async def set_state(self, key, state=None):
+        metrics.inc('fsm_writes')
+        key_str = serialize_key(key)
+        _, data = await self._load(key_str)
+        state = state.state if isinstance(state, State) else state
+        await self._store(key_str, (state, data))
+
+    async def get_state(self, key):
+        metrics.inc('fsm_reads')
+        state, _ = await self._load(serialize_key(key))
+        return state
+
+    async def set_data(self, key, data):
+        metrics.inc('fsm_writes')
+        key_str = serialize_key(key)
+        state, _ = await self._load(key_str)
+        await self._store(key_str, (state, data.copy()))
+
+    async def get_data(self, key):
+        metrics.inc('fsm_reads')
+        _, data = await self._load(serialize_key(key))
+        return data.copy()
+
+
+class ActivityTracker:
+    """Время последней активности по ключам FSM (LRU-порядок).
+
+    Ключи, к которым не обращались дольше max_idle секунд, а также самые
+    старые ключи сверх max_keys считаются брошенными и подлежат вытеснению.
+    owns(user_id) отбирает пользователей, за которых отвечает этот процесс:
+    чужие ключи не отслеживаются и не вытесняются, даже если процесс
+    однажды изменил их состояние (например, состояние партнера).
+    """
+
+    def __init__(self, max_keys=100000, owns=None):
+        self.max_keys = max_keys
+        self.owns = owns
+        self.last_seen = OrderedDict()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def _owned(self, key: StorageKey):
+        return self.owns is None or self.owns(key.user_id)
+
+    def touch(self, key: StorageKey, timestamp=None):
+        if not self._owned(key):
+            return
+        self.last_seen[key] = time.time() if timestamp is None else timestamp
+        self.last_seen.move_to_end(key)
+
+    def seed(self, items):
+        """Заполнение из сохраненных записей [(key, timestamp)] при старте"""
+        for key, timestamp in sorted(items, key=lambda item: item[1], reverse=True):
+            if key not in self.last_seen and self._owned(key):
+                self.last_seen[key] = timestamp
+                self.last_seen.move_to_end(key, last=False)
+
+    def pop_idle(self, max_idle):
+        """Извлечение ключей для вытеснения, от самых старых к новым"""
+        deadline = time.time() - max_idle
+        idle = []
+        while self.last_seen:
+            key, timestamp = next(iter(self.last_seen.items()))
+            if timestamp >= deadline and len(self.last_seen) <= self.max_keys:
+                break
+            self.last_seen.popitem(last=False)
+            if self._owned(key):
+                idle.append(key)
+        return idle
@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+
+# Транслитерация кириллицы, чтобы «Шрек 2» и «Shrek 2» сводились к одной строке
+TRANSLITERATION = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+# Разделители названий в ответе «Интерстеллар, матрица; Шрек 2»
+FAVORITES_SEPARATOR = re.compile(r"[,;\n]+")
+
+# Союз между названиями «Интерстеллар и Шрек 2»; он же встречается внутри
+# названий («Ромео и Джульетта», «Pride and Prejudice»), см. TitleIndex.resolve
+TITLE_CONJUNCTION = re.compile(r"\s+(?:и|and)\s+", re.IGNORECASE)
+
+
+def normalize_title(title):
+    """Название в нижнем регистре латиницей, без знаков препинания"""
+    text = title.lower().translate(TRANSLITERATION)
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return text.strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def split_favorites(text):
+    return [part.strip() for part in FAVORITES_SEPARATOR.split(text or '') if part.strip()]
+
+
+class TitleIndex:
+    """Нечеткий поиск фильмов каталога по названию.
+
+    Каждое название каталога («Русское / Original») индексируется по обеим
+    частям. Точные совпадения после нормализации находятся через словарь,
+    остальные — по доле общих триграмм (коэффициент Жаккара).
+    """
+
+    def __init__(self, titles, min_similarity=0.45):
+        self.min_similarity = min_similarity
+        self.exact = {}
+        postings = {}
+        entry_movies = []
+        entry_sizes = []
+
+        for movie_id in range(len(titles)):
+            for name in titles[movie_id].split('/'):
+                normalized = normalize_title(name)
+                if not normalized:
+                    continue
+                self.exact.setdefault(normalized, movie_id)
+
+                entry = len(entry_movies)
+                grams = trigrams(normalized)
+                entry_movies.append(movie_id)
+                entry_sizes.append(len(grams))
+                for gram in grams:
+                    postings.setdefault(gram, []).append(entry)
+
+        self.postings = {gram: np.array(entries, dtype=np.int32) for gram, entries in postings.items()}
+        self.entry_movies = np.array(entry_movies, dtype=np.int32)
+        self.entry_sizes = np.array(entry_sizes, dtype=np.float32)
+
+    def lookup(self, title):
+        """ID фильма для одного названия или None"""
+        normalized = normalize_title(title)
+        if not normalized:
+            return None
+        if normalized in self.exact:
+            return self.exact[normalized]
+
+        grams = trigrams(normalized)
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists:
+            return None
+
+        common = np.bincount(np.concatenate(lists), minlength=len(self.entry_movies))
+        similarity = common / (self.entry_sizes + len(grams) - common)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.min_similarity:
+            return None
+        return int(self.entry_movies[best])
+
+    def resolve(self, text):
+        """ID фильмов из ответа со списком любимых фильмов, без повторов"""
+        movie_ids = []
+        for part in split_favorites(text):
+            for movie_id in self._resolve_part(part):
+                if movie_id not in movie_ids:
+                    movie_ids.append(movie_id)
+        return movie_ids
+
+    def _resolve_part(self, part):
+        """Фильмы из одного элемента списка: названия, возможно, через «и».
+
+        Сначала ищется точное название целиком. Делить по союзу можно,
+        только если нашлась каждая часть, иначе «Гарри Поттер и Тайная
+        комната» с опечаткой распалась бы на два чужих фильма; тогда
+        фраза ищется целиком нечетко.
+        """
+        normalized = normalize_title(part)
+        if normalized in self.exact:
+            return [self.exact[normalized]]
+
+        pieces = [piece for piece in TITLE_CONJUNCTION.split(part) if piece.strip()]
+        if len(pieces) > 1:
+            movie_ids = [self.lookup(piece) for piece in pieces]
+            if None not in movie_ids:
+                return movie_ids
+
+        movie_id = self.lookup(part)
+        return [] if movie_id is None else [movie_id]
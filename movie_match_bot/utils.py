@@ -5,8 +5,28 @@ from config import (
     GEMINI_API_KEY,
     GEMINI_MODEL,
     GEMINI_TEMPERATURE,
-    GEMINI_MAX_TOKENS
+    GEMINI_MAX_TOKENS,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_MAX_QUEUE,
+    GEMINI_STRUCTURED_OUTPUT,
+    GEMINI_STRUCTURED_MAX_TOKENS,
+    RECOMMENDATION_BACKEND,
+    MOVIE_CATALOG_PATH,
+    LOCAL_JOINT_OBJECTIVE,
+    LOCAL_TOP_K
 )
+from recommendation_cache import make_cache_key
+from features import features_from_answers, genres_from_mask, moods_from_mask
+from title_index import split_favorites
+from rendering import (
+    parse_films,
+    parse_partial_films,
+    render_films_html,
+    render_films_markdown,
+    escape_plain_text
+)
+from llm_dispatcher import LLMDispatcher, PRIORITY_INTERACTIVE
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,56 +40,282 @@ if GEMINI_API_KEY:
 else:
     logger.warning("GEMINI_API_KEY не найден, будет использоваться резервный режим")
 
+# Настройки генерации и фильтров безопасности, общие для всех запросов
+GENERATION_CONFIG = {
+    "temperature": GEMINI_TEMPERATURE,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": GEMINI_MAX_TOKENS,
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+]
+
+# Все запросы к Gemini идут через общий диспетчер с ограниченным пулом
+llm_dispatcher = LLMDispatcher(
+    max_workers=GEMINI_MAX_CONCURRENCY,
+    max_queue=GEMINI_MAX_QUEUE,
+    name='gemini'
+)
 
-async def generate_movie_recommendations(user1_answers, user2_answers):
-    """Генерация рекомендаций фильмов через Gemini API"""
+# В структурном режиме Gemini возвращает JSON, а бот сам рендерит HTML
+RECOMMENDATIONS_PARSE_MODE = 'HTML' if GEMINI_STRUCTURED_OUTPUT else 'Markdown'
 
-    prompt = create_prompt(user1_answers, user2_answers)
+# Локальный подбор по каталогу; загружается при старте, если задан каталог
+local_recommender = None
 
-    if not GEMINI_API_KEY:
-        logger.warning("Gemini API ключ не найден, используем резервные рекомендации")
-        return get_fallback_recommendations(user1_answers, user2_answers)
+# Реестр клиентов Gemini: (модель, переопределения настроек) -> GenerativeModel
+_models = {}
 
-    try:
-        # Настраиваем модель Gemini
-        generation_config = {
-            "temperature": GEMINI_TEMPERATURE,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": GEMINI_MAX_TOKENS,
-        }
 
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-        ]
+def get_model(model_name=None, **config_overrides):
+    """Клиент Gemini, созданный один раз и переиспользуемый всеми запросами"""
+    model_name = model_name or GEMINI_MODEL
+    registry_key = (model_name, tuple(sorted(config_overrides.items())))
 
+    model = _models.get(registry_key)
+    if model is None:
         model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+            model_name=model_name,
+            generation_config={**GENERATION_CONFIG, **config_overrides},
+            safety_settings=SAFETY_SETTINGS
         )
+        _models[registry_key] = model
+    return model
+
+
+def get_model_overrides():
+    """Настройки модели, отличающиеся от общих для текущего режима"""
+    if GEMINI_STRUCTURED_OUTPUT:
+        return {"max_output_tokens": GEMINI_STRUCTURED_MAX_TOKENS}
+    return {}
+
+
+def warm_up_models():
+    """Создание клиента Gemini заранее, при запуске бота"""
+    if not GEMINI_API_KEY:
+        return
+
+    try:
+        get_model(**get_model_overrides())
+        logger.info("Клиент Gemini подготовлен")
+    except Exception as e:
+        logger.error(f"Не удалось подготовить клиент Gemini: {str(e)}")
+
+
+def load_local_recommender():
+    """Загрузка каталога фильмов для локального подбора"""
+    global local_recommender
+
+    if not MOVIE_CATALOG_PATH:
+        if RECOMMENDATION_BACKEND == 'local':
+            logger.warning("MOVIE_CATALOG_PATH не задан, локальный подбор недоступен")
+        return
+
+    try:
+        from catalog import load_catalog
+        from recommender import LocalRecommender
+    except ImportError as e:
+        logger.error(f"Локальный подбор недоступен, не установлен numpy: {str(e)}")
+        return
+
+    try:
+        catalog = load_catalog(MOVIE_CATALOG_PATH)
+        local_recommender = LocalRecommender(catalog, objective=LOCAL_JOINT_OBJECTIVE)
+        logger.info(f"Каталог фильмов загружен: {len(catalog)} фильмов")
+    except Exception as e:
+        logger.error(f"Не удалось загрузить каталог фильмов: {str(e)}")
+
+
+async def build_title_index():
+    """Построение индекса названий каталога в отдельном потоке.
+
+    Для индекса названия декодируются из отображенного в память каталога,
+    на больших каталогах это занимает секунды, поэтому старт бота его не
+    ждет. Пока индекс строится, любимые фильмы не сопоставляются с каталогом
+    и в промпт идут текстом пользователя.
+    """
+    if local_recommender is None:
+        return
+
+    from title_index import TitleIndex
+
+    try:
+        title_index = await asyncio.to_thread(TitleIndex, local_recommender.catalog.titles)
+    except Exception as e:
+        logger.error(f"Не удалось построить индекс названий: {str(e)}")
+        return
+    local_recommender.title_index = title_index
+    logger.info("Индекс названий фильмов построен")
+
+
+def render_films(films):
+    """Оформление списка фильмов для RECOMMENDATIONS_PARSE_MODE"""
+    if RECOMMENDATIONS_PARSE_MODE == 'HTML':
+        return render_films_html(films)
+    return render_films_markdown(films)
+
+
+def resolve_favorites(answer):
+    """Любимые фильмы из ответа парами [ID, название]; пусто, если каталог не загружен.
+
+    По названию LocalRecommender.favorite_ids отбрасывает записи, ID которых
+    после пересборки каталога указывает на другой фильм.
+    """
+    if local_recommender is None or local_recommender.title_index is None:
+        return []
+    titles = local_recommender.catalog.titles
+    return [[movie_id, titles[movie_id]] for movie_id in local_recommender.title_index.resolve(answer)]
+
+
+def ensure_features(user1_answers, user2_answers, features=None):
+    """Пара записей признаков; для ответов без сохраненных признаков они
+    собираются из текста"""
+    if features is not None and features[0] is not None and features[1] is not None:
+        return features
+    return (
+        features_from_answers(user1_answers, resolve_favorites),
+        features_from_answers(user2_answers, resolve_favorites)
+    )
+
+
+def get_local_recommendations(user1_answers, user2_answers, features=None):
+    """Подбор по каталогу; None, если каталог не загружен или пуст"""
+    if local_recommender is None:
+        return None
+
+    features1, features2 = ensure_features(user1_answers, user2_answers, features)
+    films = local_recommender.recommend(features1, features2, k=LOCAL_TOP_K)
+    if not films:
+        return None
+    return render_films(films)
+
+
+async def generate_movie_recommendations(user1_answers, user2_answers, cache=None, on_partial=None,
+                                         use_fallback=True, priority=PRIORITY_INTERACTIVE, features=None):
+    """Генерация рекомендаций фильмов через Gemini API.
+
+    features — пара записей признаков, собранных в момент ответов
+    (features.update_features); без нее признаки собираются из текста.
+
+    Если передан кэш, сначала ищем готовые рекомендации для таких же
+    ответов пары; в кэш попадают только ответы Gemini, не резервные подборки.
+    Если передан on_partial, ответ запрашивается потоком и on_partial
+    вызывается с накопленным текстом по мере его поступления.
+    При use_fallback=False вместо резервной подборки возвращается None.
+    """
+
+    features = ensure_features(user1_answers, user2_answers, features)
+
+    if RECOMMENDATION_BACKEND == 'local':
+        recommendations = get_local_recommendations(user1_answers, user2_answers, features)
+        if recommendations:
+            return recommendations
+
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(user1_answers, user2_answers, variant=RECOMMENDATIONS_PARSE_MODE,
+                                   features=features)
+        cached = await cache.get(cache_key)
+        if cached:
+            logger.info("Рекомендации найдены в кэше")
+            return cached
+
+    prompt = build_prompt(user1_answers, user2_answers, features)
+
+    if not GEMINI_API_KEY:
+        logger.warning("Gemini API ключ не найден, используем резервные рекомендации")
+        if not use_fallback:
+            return None
+        return render_fallback_recommendations(user1_answers, user2_answers, features)
+
+    if GEMINI_STRUCTURED_OUTPUT:
+        recommendations = await request_structured_recommendations(prompt, priority=priority, on_partial=on_partial)
+    else:
+        recommendations = await request_gemini_recommendations(prompt, priority=priority, on_partial=on_partial)
+
+    if recommendations is None:
+        metrics.inc('gemini_fallbacks')
+        if not use_fallback:
+            return None
+        return render_fallback_recommendations(user1_answers, user2_answers, features)
+
+    if cache is not None:
+        try:
+            await cache.put(cache_key, recommendations)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить рекомендации в кэш: {str(e)}")
+
+    return recommendations
+
+
+async def request_structured_recommendations(prompt, priority=PRIORITY_INTERACTIVE, on_partial=None):
+    """Запрос JSON-подборки к Gemini; возвращает готовый HTML или None"""
+
+    render_partial = None
+    if on_partial is not None:
+        def render_partial(text):
+            films = parse_partial_films(text)
+            if films:
+                on_partial(render_films_html(films))
+
+    text = await request_gemini_recommendations(prompt, priority=priority, on_partial=render_partial)
+    if text is None:
+        return None
+
+    films = parse_films(text)
+    if not films:
+        logger.error(f"Gemini вернул некорректный JSON: {text[:200]}")
+        metrics.inc('gemini_invalid_json')
+        return None
+    return render_films_html(films)
+
+
+async def request_gemini_recommendations(prompt, priority=PRIORITY_INTERACTIVE, on_partial=None):
+    """Запрос к Gemini; возвращает текст ответа или None при ошибке"""
+
+    try:
+        model = get_model(**get_model_overrides())
 
         logger.info("Отправляем запрос к Gemini API...")
 
-        # Выполняем генерацию
-        response = await asyncio.to_thread(
+        if on_partial is not None:
+            text = await llm_dispatcher.submit(
+                stream_content,
+                model,
+                prompt,
+                asyncio.get_running_loop(),
+                on_partial,
+                priority=priority
+            )
+            if text:
+                logger.info("Успешно получили рекомендации от Gemini (поток)")
+                return text
+            logger.error("Пустой потоковый ответ от Gemini")
+            return None
+
+        # Выполняем генерацию; одинаковые промпты в работе объединяются
+        response = await llm_dispatcher.submit(
             model.generate_content,
-            prompt
+            prompt,
+            priority=priority,
+            dedup_key=prompt
         )
 
         if response and response.text:
@@ -77,15 +323,55 @@ async def generate_movie_recommendations(user1_answers, user2_answers):
             return response.text
         else:
             logger.error(f"Пустой ответ от Gemini: {response}")
-            return get_fallback_recommendations(user1_answers, user2_answers)
+            return None
 
     except Exception as e:
         logger.error(f"Ошибка при обращении к Gemini API: {str(e)}")
-        return get_fallback_recommendations(user1_answers, user2_answers)
+        return None
 
 
-def create_prompt(user1_answers, user2_answers):
-    """Создание промпта для Gemini на основе ответов пользователей"""
+def stream_content(model, prompt, loop, on_partial):
+    """Потоковая генерация в потоке пула; on_partial вызывается в цикле событий"""
+    chunks = []
+    for chunk in model.generate_content(prompt, stream=True):
+        if chunk.text:
+            chunks.append(chunk.text)
+            loop.call_soon_threadsafe(on_partial, ''.join(chunks))
+    return ''.join(chunks)
+
+
+def build_prompt(user1_answers, user2_answers, features=None):
+    """Промпт для текущего режима вывода"""
+    features = ensure_features(user1_answers, user2_answers, features)
+    if GEMINI_STRUCTURED_OUTPUT:
+        return create_structured_prompt(user1_answers, user2_answers, features)
+    return create_prompt(user1_answers, user2_answers, features)
+
+
+def describe_favorites(answer, favorites):
+    """Любимые фильмы с точными названиями и годами из каталога, если они найдены.
+
+    Если найдены не все фильмы из ответа, исходный текст остается в скобках.
+    """
+    if local_recommender is None or not favorites or answer == "не указано":
+        return answer
+
+    favorite_ids = local_recommender.favorite_ids(favorites)
+    if not favorite_ids:
+        return answer
+
+    titles = []
+    for movie_id in favorite_ids:
+        movie = local_recommender.catalog.movie(movie_id)
+        titles.append(f"{movie['title']} ({movie['year']})" if movie['year'] else movie['title'])
+    if len(favorite_ids) < len(split_favorites(answer)):
+        return f"{', '.join(titles)} ({answer})"
+    return ', '.join(titles)
+
+
+def describe_users(user1_answers, user2_answers, features):
+    """Блок промпта с предпочтениями обоих пользователей"""
+    features1, features2 = features
 
     # Форматируем ответы
     def format_answer(answer, default="не указано"):
@@ -96,8 +382,8 @@ def create_prompt(user1_answers, user2_answers):
     # Извлекаем данные
     user1_genre = format_answer(user1_answers.get('genre'))
     user2_genre = format_answer(user2_answers.get('genre'))
-    user1_movies = format_answer(user1_answers.get('favorite_movies'))
-    user2_movies = format_answer(user2_answers.get('favorite_movies'))
+    user1_movies = describe_favorites(format_answer(user1_answers.get('favorite_movies')), features1["favorites"])
+    user2_movies = describe_favorites(format_answer(user2_answers.get('favorite_movies')), features2["favorites"])
     user1_mood = format_answer(user1_answers.get('mood'))
     user2_mood = format_answer(user2_answers.get('mood'))
     user1_duration = format_answer(user1_answers.get('duration'))
@@ -107,6 +393,28 @@ def create_prompt(user1_answers, user2_answers):
     user1_additional = format_answer(user1_answers.get('additional'), 'нет')
     user2_additional = format_answer(user2_answers.get('additional'), 'нет')
 
+    return f"""ДАННЫЕ О ПОЛЬЗОВАТЕЛЯХ:
+
+👤 ПОЛЬЗОВАТЕЛЬ 1:
+🎭 Любимые жанры: {user1_genre}
+🎞 Любимые фильмы: {user1_movies}
+😊 Текущее настроение: {user1_mood}
+⏱️ Предпочитаемая длительность: {user1_duration}
+📅 Предпочтительные годы выпуска: {user1_year}
+💡 Дополнительные пожелания: {user1_additional}
+
+👤 ПОЛЬЗОВАТЕЛЬ 2:
+🎭 Любимые жанры: {user2_genre}
+🎞 Любимые фильмы: {user2_movies}
+😊 Текущее настроение: {user2_mood}
+⏱️ Предпочитаемая длительность: {user2_duration}
+📅 Предпочтительные годы выпуска: {user2_year}
+💡 Дополнительные пожелания: {user2_additional}"""
+
+
+def create_prompt(user1_answers, user2_answers, features):
+    """Создание промпта для Gemini на основе ответов пользователей"""
+
     prompt = f"""
 ТЫ: Эксперт по кино с 20-летним стажем, кинокритик и психолог. Ты помогаешь парам и друзьям находить идеальные фильмы для совместного просмотра.
 
@@ -128,23 +436,7 @@ def create_prompt(user1_answers, user2_answers):
 7. Ответ должен быть на русском языке
 8. В конце дай общие советы по выбору
 
-ДАННЫЕ О ПОЛЬЗОВАТЕЛЯХ:
-
-👤 ПОЛЬЗОВАТЕЛЬ 1:
-🎭 Любимые жанры: {user1_genre}
-🎞 Любимые фильмы: {user1_movies}
-😊 Текущее настроение: {user1_mood}
-⏱️ Предпочитаемая длительность: {user1_duration}
-📅 Предпочтительные годы выпуска: {user1_year}
-💡 Дополнительные пожелания: {user1_additional}
-
-👤 ПОЛЬЗОВАТЕЛЬ 2:
-🎭 Любимые жанры: {user2_genre}
-🎞 Любимые фильмы: {user2_movies}
-😊 Текущее настроение: {user2_mood}
-⏱️ Предпочитаемая длительность: {user2_duration}
-📅 Предпочтительные годы выпуска: {user2_year}
-💡 Дополнительные пожелания: {user2_additional}
+{describe_users(user1_answers, user2_answers, features)}
 
 ПРИМЕЧАНИЕ: Если какие-то данные не указаны ("не указано"), используй свой экспертный опыт, чтобы подобрать универсальные, но интересные варианты.
 
@@ -160,145 +452,178 @@ def create_prompt(user1_answers, user2_answers):
     return prompt
 
 
-def get_fallback_recommendations(user1_answers, user2_answers):
-    """Резервные рекомендации на случай ошибки API"""
+def create_structured_prompt(user1_answers, user2_answers, features):
+    """Промпт для ответа в виде компактного JSON; оформление делает бот"""
 
-    # Анализируем предпочтения
-    def extract_keywords(answer):
-        if not answer:
-            return []
-        keywords = []
-        text = answer.lower()
+    prompt = f"""
+ТЫ: Эксперт по кино. Подбери 5-7 фильмов для совместного просмотра, которые понравятся ОБОИМ пользователям.
 
-        # Жанры
-        genres = ["комедия", "драма", "фантастика", "боевик", "триллер",
-                  "мелодрама", "детектив", "ужасы", "фэнтези", "приключения",
-                  "аниме", "мультфильм", "биография", "история", "документальный"]
+{describe_users(user1_answers, user2_answers, features)}
 
-        for genre in genres:
-            if genre in text:
-                keywords.append(genre)
+Если данные не указаны, подбери универсальные, но интересные варианты.
 
-        # Настроение
-        moods = ["веселое", "романтическое", "грустное", "напряженное",
-                 "расслабленное", "вдохновляющее", "страшное", "загадочное"]
+Ответь ТОЛЬКО JSON без markdown и пояснений, строго по схеме:
+{{"films":[{{"title":"Русское название / Original title","year":2010,"genres":["жанр"],"rating":8.1,"reason":"почему подходит этой паре, одно предложение"}}]}}
+"""
 
-        for mood in moods:
-            if mood in text:
-                keywords.append(mood)
+    return prompt
 
-        return keywords if keywords else ["универсальный", "популярный"]
 
-    user1_keywords = extract_keywords(user1_answers.get('genre', '') + ' ' + user1_answers.get('mood', ''))
-    user2_keywords = extract_keywords(user2_answers.get('genre', '') + ' ' + user2_answers.get('mood', ''))
+def render_fallback_recommendations(user1_answers, user2_answers, features=None):
+    """Резервные рекомендации, подготовленные для RECOMMENDATIONS_PARSE_MODE"""
+    features = ensure_features(user1_answers, user2_answers, features)
+    recommendations = get_local_recommendations(user1_answers, user2_answers, features)
+    if recommendations:
+        return recommendations
+
+    recommendations = get_fallback_recommendations(*features)
+    if RECOMMENDATIONS_PARSE_MODE == 'HTML':
+        return escape_plain_text(recommendations)
+    return recommendations
+
+
+# Резервный каталог фильмов по категориям; загружается один раз при импорте
+FALLBACK_MOVIES = {
+    "комедия": [
+        {
+            "title": "🎬 1+1 / Intouchables",
+            "year": "2011",
+            "genre": "комедия, драма, биография",
+            "rating": "⭐ 8.5/10",
+            "description": "Постигший паралич аристократ нанимает в сиделки бывшего заключенного. Искренняя дружба и юмор, меняющие жизни обоих.",
+            "why": "Идеальный баланс юмора и глубоких эмоций. Поднимает настроение, но также заставляет задуматься."
+        },
+        {
+            "title": "🎬 Джентльмены / The Gentlemen",
+            "year": "2019",
+            "genre": "комедия, боевик, криминал",
+            "rating": "⭐ 7.8/10",
+            "description": "Американский наркобарон пытается продать свою империю лондонской преступной группировке.",
+            "why": "Стильный, остроумный и динамичный фильм с блестящим актерским составом."
+        }
+    ],
+    "драма": [
+        {
+            "title": "🎬 Побег из Шоушенка / The Shawshank Redemption",
+            "year": "1994",
+            "genre": "драма",
+            "rating": "⭐ 9.3/10",
+            "description": "Невинно осужденный банкир проводит годы в тюрьме, не теряя надежды на свободу.",
+            "why": "Один из лучших фильмов всех времен. История о надежде, дружбе и человеческом духе."
+        },
+        {
+            "title": "🎬 Форрест Гамп / Forrest Gump",
+            "year": "1994",
+            "genre": "драма, комедия, мелодрама",
+            "rating": "⭐ 8.8/10",
+            "description": "Простой парень с добрым сердцем становится невольным участником ключевых событий американской истории.",
+            "why": "Трогательная история, которая сочетает юмор, драму и исторические события."
+        }
+    ],
+    "фантастика": [
+        {
+            "title": "🎬 Начало / Inception",
+            "year": "2010",
+            "genre": "фантастика, боевик, триллер",
+            "rating": "⭐ 8.8/10",
+            "description": "Профессиональный вор, специализирующийся на краже идей из подсознания, получает задание внедрить идею.",
+            "why": "Умный и визуально впечатляющий фильм, который заставляет думать."
+        },
+        {
+            "title": "🎬 Интерстеллар / Interstellar",
+            "year": "2014",
+            "genre": "фантастика, драма, приключения",
+            "rating": "⭐ 8.6/10",
+            "description": "Группа исследователей путешествует через червоточину в поисках нового дома для человечества.",
+            "why": "Эпичное космическое путешествие с глубоким эмоциональным посылом."
+        }
+    ],
+    "популярный": [
+        {
+            "title": "🎬 Король Лев / The Lion King",
+            "year": "1994",
+            "genre": "мультфильм, драма, приключения",
+            "rating": "⭐ 8.5/10",
+            "description": "Молодой лев Симба предает свое королевство изгнанным тираном, только чтобы вернуться и отвоевать его.",
+            "why": "Великолепная анимация, незабываемая музыка и вечная история взросления."
+        },
+        {
+            "title": "🎬 Титаник / Titanic",
+            "year": "1997",
+            "genre": "драма, мелодрама",
+            "rating": "⭐ 7.9/10",
+            "description": "Семнадцатилетняя аристократка влюбляется в доброго, но бедного художника на борту роскошного лайнера.",
+            "why": "Эпическая история любви, которая покорила весь мир."
+        }
+    ],
+    "романтическое": [
+        {
+            "title": "🎬 Дневник памяти / The Notebook",
+            "year": "2004",
+            "genre": "драма, мелодрама",
+            "rating": "⭐ 7.8/10",
+            "description": "Пожилой мужчина читает своей жене историю любви двух молодых людей в 1940-х годах.",
+            "why": "Одна из самых трогательных и красивых историй любви в кино."
+        }
+    ]
+}
+
+
+def build_keyword_index(movies_by_category):
+    """Инвертированный индекс: ключевое слово -> фильмы.
+
+    Фильм попадает в индекс по своей категории и по каждому из своих жанров.
+    """
+    index = {}
+    indexed = set()
+    for category, movies in movies_by_category.items():
+        for movie in movies:
+            index.setdefault(category, []).append(movie)
+            indexed.add((category, movie["title"]))
+    for movies in movies_by_category.values():
+        for movie in movies:
+            for genre in movie["genre"].split(","):
+                genre = genre.strip()
+                if (genre, movie["title"]) not in indexed:
+                    index.setdefault(genre, []).append(movie)
+                    indexed.add((genre, movie["title"]))
+    return index
+
 
-    # Находим общие ключевые слова
-    common_keywords = set(user1_keywords) & set(user2_keywords)
+KEYWORD_INDEX = build_keyword_index(FALLBACK_MOVIES)
+
+
+def get_fallback_recommendations(user1_features, user2_features):
+    """Резервные рекомендации на случай ошибки API"""
+
+    # Находим общие жанры и настроения
+    common_keywords = (
+        genres_from_mask(user1_features["genres"] & user2_features["genres"])
+        + moods_from_mask(user1_features["moods"] & user2_features["moods"])
+    )
     if not common_keywords:
-        common_keywords = {"комедия", "драма", "популярный"}
-
-    # База фильмов с категориями
-    movie_database = {
-        "комедия": [
-            {
-                "title": "🎬 1+1 / Intouchables",
-                "year": "2011",
-                "genre": "комедия, драма, биография",
-                "rating": "⭐ 8.5/10",
-                "description": "Постигший паралич аристократ нанимает в сиделки бывшего заключенного. Искренняя дружба и юмор, меняющие жизни обоих.",
-                "why": "Идеальный баланс юмора и глубоких эмоций. Поднимает настроение, но также заставляет задуматься."
-            },
-            {
-                "title": "🎬 Джентльмены / The Gentlemen",
-                "year": "2019",
-                "genre": "комедия, боевик, криминал",
-                "rating": "⭐ 7.8/10",
-                "description": "Американский наркобарон пытается продать свою империю лондонской преступной группировке.",
-                "why": "Стильный, остроумный и динамичный фильм с блестящим актерским составом."
-            }
-        ],
-        "драма": [
-            {
-                "title": "🎬 Побег из Шоушенка / The Shawshank Redemption",
-                "year": "1994",
-                "genre": "драма",
-                "rating": "⭐ 9.3/10",
-                "description": "Невинно осужденный банкир проводит годы в тюрьме, не теряя надежды на свободу.",
-                "why": "Один из лучших фильмов всех времен. История о надежде, дружбе и человеческом духе."
-            },
-            {
-                "title": "🎬 Форрест Гамп / Forrest Gump",
-                "year": "1994",
-                "genre": "драма, комедия, мелодрама",
-                "rating": "⭐ 8.8/10",
-                "description": "Простой парень с добрым сердцем становится невольным участником ключевых событий американской истории.",
-                "why": "Трогательная история, которая сочетает юмор, драму и исторические события."
-            }
-        ],
-        "фантастика": [
-            {
-                "title": "🎬 Начало / Inception",
-                "year": "2010",
-                "genre": "фантастика, боевик, триллер",
-                "rating": "⭐ 8.8/10",
-                "description": "Профессиональный вор, специализирующийся на краже идей из подсознания, получает задание внедрить идею.",
-                "why": "Умный и визуально впечатляющий фильм, который заставляет думать."
-            },
-            {
-                "title": "🎬 Интерстеллар / Interstellar",
-                "year": "2014",
-                "genre": "фантастика, драма, приключения",
-                "rating": "⭐ 8.6/10",
-                "description": "Группа исследователей путешествует через червоточину в поисках нового дома для человечества.",
-                "why": "Эпичное космическое путешествие с глубоким эмоциональным посылом."
-            }
-        ],
-        "популярный": [
-            {
-                "title": "🎬 Король Лев / The Lion King",
-                "year": "1994",
-                "genre": "мультфильм, драма, приключения",
-                "rating": "⭐ 8.5/10",
-                "description": "Молодой лев Симба предает свое королевство изгнанным тираном, только чтобы вернуться и отвоевать его.",
-                "why": "Великолепная анимация, незабываемая музыка и вечная история взросления."
-            },
-            {
-                "title": "🎬 Титаник / Titanic",
-                "year": "1997",
-                "genre": "драма, мелодрама",
-                "rating": "⭐ 7.9/10",
-                "description": "Семнадцатилетняя аристократка влюбляется в доброго, но бедного художника на борту роскошного лайнера.",
-                "why": "Эпическая история любви, которая покорила весь мир."
-            }
-        ],
-        "романтическое": [
-            {
-                "title": "🎬 Дневник памяти / The Notebook",
-                "year": "2004",
-                "genre": "драма, мелодрама",
-                "rating": "⭐ 7.8/10",
-                "description": "Пожилой мужчина читает своей жене историю любви двух молодых людей в 1940-х годах.",
-                "why": "Одна из самых трогательных и красивых историй любви в кино."
-            }
-        ]
-    }
-
-    # Собираем фильмы
+        common_keywords = ["комедия", "драма", "популярный"]
+
+    # Собираем по индексу первые 6 фильмов, не просматривая списки целиком
     selected_movies = []
-    categories_used = set()
+    selected_titles = set()
 
     for keyword in common_keywords:
-        if keyword in movie_database and keyword not in categories_used:
-            selected_movies.extend(movie_database[keyword])
-            categories_used.add(keyword)
-            if len(selected_movies) >= 6:
-                break
+        for movie in KEYWORD_INDEX.get(keyword, ()):
+            if movie["title"] not in selected_titles:
+                selected_movies.append(movie)
+                selected_titles.add(movie["title"])
+                if len(selected_movies) >= 6:
+                    break
+        if len(selected_movies) >= 6:
+            break
 
     # Если мало фильмов, добавляем из популярных
     if len(selected_movies) < 4:
-        for movie in movie_database["популярный"]:
-            if movie not in selected_movies:
+        for movie in FALLBACK_MOVIES["популярный"]:
+            if movie["title"] not in selected_titles:
                 selected_movies.append(movie)
+                selected_titles.add(movie["title"])
 
     # Формируем ответ
     recommendations = "🎬 ВАША ПЕРСОНАЛЬНАЯ ПОДБОРКА ФИЛЬМОВ 🍿\n\n"
@@ -316,4 +641,4 @@ def get_fallback_recommendations(user1_answers, user2_answers):
     recommendations += "• Попробуйте что-то новое вместе!\n\n"
     recommendations += "🍿 Приятного просмотра!"
 
-    return recommendations
\ No newline at end of file
+    return recommendations
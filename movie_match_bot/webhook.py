@@ -0,0 +1,102 @@
+import logging
+import os
+import subprocess
+import sys
+
+import aiohttp
+from aiohttp import web
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, которым Telegram подтверждает, что обновление пришло от него
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(update):
+    """ID пользователя, от которого пришло обновление, или None"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user')
+        if isinstance(sender, dict) and 'id' in sender:
+            return sender['id']
+        chat = value.get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return None
+
+
+def worker_port(base_port, index):
+    """Локальный порт рабочего процесса index"""
+    return base_port + 1 + index
+
+
+def start_workers(script, count, base_port):
+    """Запуск count рабочих процессов бота, каждый на своем локальном порту"""
+    processes = []
+    for index in range(count):
+        env = dict(os.environ, WEBHOOK_WORKER_INDEX=str(index))
+        processes.append(subprocess.Popen([sys.executable, script], env=env))
+        logger.info(f"Запущен рабочий процесс {index} на порту {worker_port(base_port, index)}")
+    return processes
+
+
+def stop_workers(processes, timeout=10):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def create_router_app(path, workers, base_port, secret=None):
+    """Приложение на общем порту: принимает вебхук и передает обновление
+    рабочему процессу по user_id. Все обновления одного пользователя
+    обрабатывает один и тот же процесс, поэтому они идут по порядку.
+    """
+    app = web.Application()
+    urls = [f"http://127.0.0.1:{worker_port(base_port, index)}{path}" for index in range(workers)]
+
+    async def open_session(app):
+        app['session'] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+
+    async def close_session(app):
+        await app['session'].close()
+
+    async def route_update(request):
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+
+        body = await request.read()
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        user_id = update_user_id(update) or 0
+        index = user_id % workers
+        metrics.inc(f'webhook_routed_{index}')
+        try:
+            async with app['session'].post(
+                urls[index],
+                data=body,
+                headers={'Content-Type': 'application/json'}
+            ) as response:
+                return web.Response(status=response.status)
+        except aiohttp.ClientError as e:
+            # Telegram повторит доставку обновления позже
+            logger.error(f"Рабочий процесс {index} недоступен: {e}")
+            metrics.inc('webhook_route_errors')
+            return web.Response(status=502)
+
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    app.router.add_post(path, route_update)
+    return app
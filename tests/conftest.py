@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Модули бота импортируются как в рабочем запуске: из каталога movie_match_bot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'movie_match_bot'))
+
+# config.py требует токен при импорте; база — во временном каталоге
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='movie_match_bot_'), 'test.db'))
+os.environ.setdefault('GEMINI_API_KEY', '')
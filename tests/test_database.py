@@ -0,0 +1,29 @@
+import threading
+
+from database import MIGRATIONS, Database
+
+
+def test_concurrent_startup_applies_each_migration_once(tmp_path):
+    path = str(tmp_path / 'movies.db')
+    barrier = threading.Barrier(8)
+    errors = []
+    databases = []
+
+    def start():
+        barrier.wait()
+        try:
+            databases.append(Database(path))
+        except Exception as e:
+            errors.append(e)
+
+    # Отдельные соединения к одному файлу, как у рабочих процессов вебхука
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert databases[0].get_schema_version() == len(MIGRATIONS)
+    for db in databases:
+        db.close()
@@ -0,0 +1,114 @@
+import asyncio
+import itertools
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
+from aiogram.types import Chat, Message
+
+from delivery import MessageDelivery, fan_out
+from rendering import HTML_TAG, MAX_MESSAGE_LENGTH, split_message, to_plain_text
+
+
+class FakeBot:
+    """Бот без сети: записывает вызовы, ошибки задаются по чату и методу"""
+
+    def __init__(self, errors=None, delay=0.0):
+        self.calls = []
+        self.errors = errors or {}
+        self.delay = delay
+        self.message_ids = itertools.count(100)
+
+    async def _call(self, name, chat_id, text=None, parse_mode=None):
+        await asyncio.sleep(self.delay)
+        error = self.errors.get((chat_id, name))
+        if callable(error):
+            error = error(text, parse_mode)
+        if error is not None:
+            raise error
+        self.calls.append((name, chat_id, text, parse_mode, time.monotonic()))
+        return Message(message_id=next(self.message_ids), date=0, chat=Chat(id=chat_id, type='private'), text=text)
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        return await self._call('send_message', chat_id, text, parse_mode)
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        return await self._call('edit_message_text', chat_id, text, parse_mode)
+
+    async def delete_message(self, chat_id, message_id):
+        return await self._call('delete_message', chat_id)
+
+
+def balanced(part):
+    """Все теги части закрыты в правильном порядке"""
+    stack = []
+    for match in HTML_TAG.finditer(part):
+        if not match.group(1):
+            stack.append(match.group(2))
+        elif not stack or stack.pop() != match.group(2):
+            return False
+    return not stack
+
+
+def test_html_split_keeps_tags_and_entities_whole():
+    # Длинный абзац без переводов строк: разрез придется делать внутри <b>
+    paragraph = " ".join(
+        f'<b>Фильм {number} &amp; <a href="https://example.com/?q={number}&amp;p=1">ссылка</a></b> &lt;{number}&gt;'
+        for number in range(150)
+    )
+    text = f"<i>{paragraph}</i>\n\n" * 2
+
+    parts = split_message(text, parse_mode='HTML')
+    assert len(parts) > 2
+    for part in parts:
+        assert len(part) <= MAX_MESSAGE_LENGTH
+        assert balanced(part)
+        assert part.count("&") == part.count(";")
+        assert part.count("<") == part.count(">")
+
+    plain = [to_plain_text(part, 'HTML') for part in parts]
+    assert " ".join(" ".join(plain).split()) == " ".join(to_plain_text(text, 'HTML').split())
+
+
+def test_unparsable_markup_is_sent_as_plain_text():
+    def reject_markup(text, parse_mode):
+        if parse_mode:
+            return TelegramBadRequest(None, "Bad Request: can't parse entities: unsupported start tag")
+
+    bot = FakeBot(errors={(1, 'send_message'): reject_markup})
+    asyncio.run(MessageDelivery(bot, 1).deliver("<b>Начало</b> &amp; <x>", parse_mode='HTML'))
+
+    assert [(name, text, parse_mode) for name, _, text, parse_mode, _ in bot.calls] == \
+        [('send_message', "Начало & ", None)]
+
+
+def test_uneditable_placeholder_is_replaced_by_new_message():
+    bot = FakeBot(errors={(1, 'edit_message_text'): TelegramBadRequest(None, "Bad Request: message to edit not found")})
+    delivery = MessageDelivery(bot, 1, message_ids=[7])
+    asyncio.run(delivery.deliver("Подборка"))
+
+    assert [(name, text) for name, _, text, _, _ in bot.calls] == [('send_message', "Подборка")]
+    assert delivery.message_ids == [100]
+
+
+def test_failing_partner_does_not_block_the_other():
+    bot = FakeBot(errors={
+        (1, 'send_message'): TelegramForbiddenError(None, "Forbidden: bot was blocked by the user"),
+        (2, 'send_message'): TelegramNetworkError(None, "Connection reset"),
+    })
+    deliveries = [
+        MessageDelivery(bot, 1),
+        MessageDelivery(bot, 2, max_retries=2, retry_delay=0.2),
+        MessageDelivery(bot, 3),
+    ]
+
+    async def run():
+        started_at = time.monotonic()
+        delivered = await fan_out(deliveries, "Подборка")
+        return started_at, delivered, time.monotonic()
+
+    started_at, delivered, finished_at = asyncio.run(run())
+    assert delivered == 1
+    assert [chat_id for _, chat_id, *_ in bot.calls] == [3]
+    # Чат 3 получил подборку сразу, не дожидаясь повторов для чата 2
+    assert bot.calls[0][4] - started_at < 0.1
+    assert finished_at - started_at >= 0.6
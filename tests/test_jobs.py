@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+from database import AsyncDatabase, Database
+from jobs import GenerationQueue
+
+
+async def open_db(tmp_path):
+    db = AsyncDatabase(Database(str(tmp_path / 'jobs.db')))
+    await db.start()
+    return db
+
+
+async def stop(queue, db):
+    await queue.close()
+    await db.close()
+
+
+async def enqueue_session(db, session_id):
+    """Сессия, в которой оба ответили; задание ставит claim_completion"""
+    await db.create_session(session_id, 1)
+    await db.join_session(session_id, 2)
+    await db.save_user_answers(session_id, 1, {'genre': 'комедия'})
+    await db.save_user_answers(session_id, 2, {'genre': 'драма'})
+    assert await db.claim_completion(session_id, time.time())
+
+
+def job_row(db, session_id):
+    with db.db.lock:
+        return db.db.conn.execute(
+            'SELECT status, attempts, lease_owner FROM generation_jobs WHERE session_id = ?', (session_id,)
+        ).fetchone()
+
+
+def session_status(db, session_id):
+    with db.db.lock:
+        return db.db.conn.execute('SELECT status FROM sessions WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+
+async def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    async def run():
+        db = await open_db(tmp_path)
+        await enqueue_session(db, 'LEASE1')
+        now = time.time()
+
+        first = await db.claim_generation_job('a', now, 10)
+        # Пока аренда действует, задание никому не достается
+        assert await db.claim_generation_job('b', now + 5, 10) is None
+        second = await db.claim_generation_job('b', now + 11, 10)
+
+        assert not await db.extend_generation_job(first[0], 'a', now + 30)
+        assert not await db.finish_generation_job(first[0], 'a', now + 12)
+        await db.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first[1] == second[1] == 'LEASE1'
+    assert (first[2], second[2]) == (1, 2)
+
+
+def test_failed_attempt_is_retried_with_backoff(tmp_path):
+    calls = []
+
+    async def handler(session_id):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RuntimeError("Gemini недоступен")
+
+    async def run():
+        db = await open_db(tmp_path)
+        queue = GenerationQueue(db, handler, workers=1, retry_delay=0.3, poll_interval=0.05)
+        await enqueue_session(db, 'RETRY1')
+        await queue.start()
+        try:
+            await wait_until(lambda: job_row(db, 'RETRY1')[0] == 'done')
+            return job_row(db, 'RETRY1')
+        finally:
+            await stop(queue, db)
+
+    assert asyncio.run(run()) == ('done', 2, None)
+    assert calls[1] - calls[0] >= 0.3
+
+
+def test_exhausted_job_fails_session_and_calls_on_failure(tmp_path):
+    failed = []
+
+    async def handler(session_id):
+        raise RuntimeError("Gemini недоступен")
+
+    async def on_failure(session_id):
+        failed.append(session_id)
+
+    async def run():
+        db = await open_db(tmp_path)
+        queue = GenerationQueue(db, handler, workers=2, max_attempts=2, retry_delay=0.01,
+                                poll_interval=0.02, on_failure=on_failure)
+        await enqueue_session(db, 'FAIL01')
+        await queue.start()
+        try:
+            # on_failure вызывается после того, как задание помечено 'failed'
+            await wait_until(lambda: failed)
+            return job_row(db, 'FAIL01'), session_status(db, 'FAIL01')
+        finally:
+            await stop(queue, db)
+
+    (status, attempts, _), session = asyncio.run(run())
+    assert (status, attempts, session) == ('failed', 2, 'failed')
+    assert failed == ['FAIL01']
+
+
+def test_shutdown_requeues_job_without_counting_attempt(tmp_path):
+    started = asyncio.Event()
+
+    async def handler(session_id):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        db = await open_db(tmp_path)
+        queue = GenerationQueue(db, handler, workers=1, poll_interval=0.05)
+        await enqueue_session(db, 'STOP01')
+        await queue.start()
+        try:
+            await asyncio.wait_for(started.wait(), 5)
+            await queue.close()
+            return job_row(db, 'STOP01')
+        finally:
+            await stop(queue, db)
+
+    assert asyncio.run(run()) == ('pending', 0, None)
+
+
+def test_lost_lease_cancels_handler(tmp_path):
+    started = asyncio.Event()
+    outcome = []
+
+    async def handler(session_id):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+            outcome.append('отправлено')
+        except asyncio.CancelledError:
+            outcome.append('отменено')
+            raise
+
+    async def run():
+        db = await open_db(tmp_path)
+        queue = GenerationQueue(db, handler, workers=1, lease_seconds=0.3, poll_interval=0.05)
+        await enqueue_session(db, 'STEAL1')
+        await queue.start()
+        try:
+            await asyncio.wait_for(started.wait(), 5)
+
+            # Аренда истекла, и задание забрал исполнитель другого процесса
+            with db.db.lock:
+                db.db.conn.execute("UPDATE generation_jobs SET lease_owner = 'other' WHERE session_id = 'STEAL1'")
+                db.db.conn.commit()
+            await wait_until(lambda: outcome)
+            await asyncio.sleep(0.05)
+
+            # Исполнитель жив и берет следующие задания
+            alive = all(not task.done() for task in queue.tasks)
+            return alive, job_row(db, 'STEAL1')
+        finally:
+            await stop(queue, db)
+
+    alive, row = asyncio.run(run())
+    assert outcome == ['отменено']
+    assert alive
+    assert row == ('running', 1, 'other')
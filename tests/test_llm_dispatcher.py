@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+from llm_dispatcher import LLMDispatcher, LLMQueueFull
+
+
+def test_cancelled_request_leaves_the_queue():
+    calls = []
+    release = threading.Event()
+
+    def blocking(name):
+        release.wait(5)
+        calls.append(name)
+        return name
+
+    async def run():
+        dispatcher = LLMDispatcher(max_workers=1, name='test_llm')
+        # Первый запрос занимает единственный поток, второй ждет в очереди
+        busy = asyncio.create_task(dispatcher.submit(blocking, 'busy'))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(dispatcher.submit(blocking, 'queued'))
+        await asyncio.sleep(0.01)
+
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await busy
+        # Даем рабочему взять из очереди отмененный запрос
+        await asyncio.sleep(0.05)
+        await dispatcher.close()
+        return result
+
+    assert asyncio.run(run()) == 'busy'
+    assert calls == ['busy']
+
+
+def test_coalesced_request_survives_one_cancelled_caller():
+    release = threading.Event()
+
+    def blocking():
+        release.wait(5)
+        return 'done'
+
+    async def run():
+        dispatcher = LLMDispatcher(max_workers=1, name='test_llm')
+        first = asyncio.create_task(dispatcher.submit(blocking, dedup_key='prompt'))
+        second = asyncio.create_task(dispatcher.submit(blocking, dedup_key='prompt'))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await second
+        await dispatcher.close()
+        return result
+
+    assert asyncio.run(run()) == 'done'
+
+
+def test_cancelled_requests_do_not_fill_the_queue():
+    release = threading.Event()
+
+    def blocking(name):
+        release.wait(5)
+        return name
+
+    async def run():
+        dispatcher = LLMDispatcher(max_workers=1, max_queue=2, name='test_llm')
+        busy = asyncio.create_task(dispatcher.submit(blocking, 'busy'))
+        await asyncio.sleep(0.01)
+        abandoned = [asyncio.create_task(dispatcher.submit(blocking, f'abandoned {number}')) for number in range(2)]
+        await asyncio.sleep(0.01)
+
+        # Очередь полна живыми запросами
+        try:
+            await dispatcher.submit(blocking, 'rejected')
+        except LLMQueueFull:
+            rejected = True
+        else:
+            rejected = False
+
+        # Отмененные запросы еще лежат в очереди, но места не занимают
+        for task in abandoned:
+            task.cancel()
+        await asyncio.sleep(0)
+        live = asyncio.create_task(dispatcher.submit(blocking, 'live'))
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(busy, live)
+        await dispatcher.close()
+        return rejected, results
+
+    rejected, results = asyncio.run(run())
+    assert rejected
+    assert results == ['busy', 'live']
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+from aiogram.types import Update
+
+import bot as bot_module
+import metrics
+from storage import ActivityTracker, SQLiteStorage
+
+USER_ID = 1001
+PARTNER_ID = 1002
+update_ids = itertools.count(1)
+
+
+async def fake_request(self, method, request_timeout=None):
+    """Запросы к Bot API не уходят в сеть; ответ обработчикам не нужен"""
+    await asyncio.sleep(0)
+
+
+class SlowStorage(MemoryStorage):
+    """Хранилище, которое, как SQLite или Redis, уступает цикл событий при чтении"""
+
+    async def get_data(self, key):
+        data = await super().get_data(key)
+        await asyncio.sleep(0.01)
+        return data
+
+
+def message_update(text):
+    update_id = next(update_ids)
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }, context={"bot": bot_module.bot})
+
+
+def storage_key(user_id=USER_ID):
+    return StorageKey(bot_id=bot_module.bot.id, chat_id=user_id, user_id=user_id)
+
+
+def user_state(storage, user_id=USER_ID):
+    return FSMContext(storage=storage, key=storage_key(user_id))
+
+
+def test_quick_answers_are_not_lost(monkeypatch):
+    monkeypatch.setattr(Bot, '__call__', fake_request)
+    storage = SlowStorage()
+    monkeypatch.setattr(bot_module.dp.fsm, 'storage', storage)
+
+    async def run():
+        state = user_state(storage)
+        await state.set_state(bot_module.QuestionStates.answering)
+        await state.set_data({'session_code': 'TEST01', 'current_question': 1, 'answers': {}})
+
+        # Два ответа подряд, второй приходит до завершения обработки первого
+        await asyncio.gather(
+            bot_module.dp.feed_update(bot_module.bot, message_update("комедия")),
+            bot_module.dp.feed_update(bot_module.bot, message_update("Шрек 2")),
+        )
+        return await state.get_data()
+
+    data = asyncio.run(run())
+    assert data['answers'] == {'genre': 'комедия', 'favorite_movies': 'Шрек 2'}
+    assert data['current_question'] == 3
+
+
+def test_partner_is_released_when_session_is_abandoned(monkeypatch):
+    sent = []
+
+    async def record_request(self, method, request_timeout=None):
+        if isinstance(method, SendMessage):
+            sent.append((method.chat_id, method.text))
+
+    monkeypatch.setattr(Bot, '__call__', record_request)
+    storage = MemoryStorage()
+    activity = ActivityTracker()
+    monkeypatch.setattr(bot_module, 'storage', storage)
+    monkeypatch.setattr(bot_module, 'activity', activity)
+
+    async def run():
+        await bot_module.db.create_session('EVICT1', PARTNER_ID)
+        await bot_module.db.join_session('EVICT1', USER_ID)
+
+        # Партнер уже ответил и ждет, пользователь бросил анкету
+        state = user_state(storage)
+        await state.set_state(bot_module.QuestionStates.answering)
+        await state.set_data({'session_code': 'EVICT1', 'current_question': 2, 'answers': {}})
+        await user_state(storage, PARTNER_ID).set_data({'session_code': 'EVICT1'})
+        activity.touch(storage_key(), timestamp=0)
+
+        await bot_module.evict_abandoned_states()
+        session = await bot_module.db.get_session('EVICT1')
+        return session, await state.get_state(), await user_state(storage, PARTNER_ID).get_data()
+
+    session, user_state_after, partner_data = asyncio.run(run())
+    assert session[5] == 'abandoned'
+    assert user_state_after is None
+    assert partner_data == {}
+    assert [chat_id for chat_id, _ in sent] == [PARTNER_ID]
+
+
+def test_answer_costs_one_fsm_read_and_write(monkeypatch):
+    monkeypatch.setattr(Bot, '__call__', fake_request)
+    monkeypatch.setattr(bot_module, 'speculation', None)
+    # Без кэша и отложенной записи каждое обращение доходит до SQLite
+    storage = SQLiteStorage(bot_module.db, flush_interval=0, cache_size=0)
+
+    async def run():
+        await bot_module.db.create_session('COUNT1', PARTNER_ID)
+        await bot_module.db.join_session('COUNT1', USER_ID)
+        state = user_state(storage)
+        await state.set_state(bot_module.QuestionStates.answering)
+        await state.set_data({'session_code': 'COUNT1', 'current_question': 0, 'answers': {}})
+
+        costs = []
+        # Сообщение о готовности и ответы на все вопросы
+        for text in ["готов"] + ["ответ"] * len(bot_module.QUESTIONS):
+            reads, writes = metrics.get_counter('fsm_reads'), metrics.get_counter('fsm_writes')
+            await bot_module.process_answer(message_update(text).message, state)
+            costs.append((metrics.get_counter('fsm_reads') - reads, metrics.get_counter('fsm_writes') - writes))
+        return costs, await state.get_data()
+
+    costs, data = asyncio.run(run())
+    assert costs == [(1, 1)] * (len(bot_module.QUESTIONS) + 1)
+    assert len(data['answers']) == len(bot_module.QUESTIONS)
@@ -0,0 +1,90 @@
+import asyncio
+
+import bot as bot_module
+from catalog import MovieCatalog
+from delivery import MessageDelivery
+from features import empty_features, update_features
+from recommendation_cache import make_cache_key
+from recommender import LocalRecommender
+
+
+def make_catalog():
+    return MovieCatalog.from_records([
+        {"title": "Начало / Inception", "year": 2010, "rating": 8.8, "runtime": 148, "genres": "фантастика, боевик"},
+        {"title": "Шрек 2 / Shrek 2", "year": 2004, "rating": 7.3, "runtime": 93, "genres": "мультфильм, комедия"},
+        {"title": "Дневник памяти / The Notebook", "year": 2004, "rating": 7.8, "runtime": 123, "genres": "драма"},
+    ])
+
+
+def features_of(answers):
+    features = empty_features()
+    for key, text in answers.items():
+        features = update_features(features, key, text)
+    return features
+
+
+def test_cache_key_ignores_pair_order_and_spelling():
+    first = {"genre": "комедия", "mood": "веселое", "additional": "не указано"}
+    second = {"genre": "драма", "mood": "грустное"}
+    respelled = {"genre": "  Комедия ", "mood": "ВЕСЕЛОЕ", "additional": ""}
+
+    key = make_cache_key(first, second, features=(features_of(first), features_of(second)))
+    assert key == make_cache_key(second, first, features=(features_of(second), features_of(first)))
+    assert key == make_cache_key(respelled, second, features=(features_of(respelled), features_of(second)))
+    assert key != make_cache_key(first, second, variant='HTML',
+                                 features=(features_of(first), features_of(second)))
+
+
+def test_cache_key_separates_different_wording():
+    # Признаки у пар одинаковые, а формулировки, попадающие в промпт, — нет
+    plain = {"genre": "комедия", "mood": "веселое"}
+    detailed = {"genre": "комедия про космос, как Звёздные войны", "mood": "весёлое, но с нуаром"}
+    assert features_of(plain) == features_of(detailed)
+
+    assert make_cache_key(plain, plain, features=(features_of(plain), features_of(plain))) != \
+        make_cache_key(detailed, plain, features=(features_of(detailed), features_of(plain)))
+
+
+def test_stale_favorites_are_dropped():
+    catalog = make_catalog()
+    recommender = LocalRecommender(catalog)
+
+    valid = [1, catalog.titles[1]]
+    features = empty_features()
+    # ID за пределами каталога и ID, который теперь указывает на другой фильм
+    features["favorites"] = [[42, "Интерстеллар / Interstellar"], [0, "Шрек 2 / Shrek 2"], valid, 2]
+
+    assert recommender.favorite_ids(features["favorites"]) == [1]
+    films = recommender.recommend(features, empty_features(), k=3)
+    assert [film["title"] for film in films if film["title"] == catalog.titles[1]] == []
+    assert len(films) == 2
+
+
+def test_generation_starts_before_placeholders_are_sent(monkeypatch):
+    events = []
+
+    async def slow_placeholder(chat_id):
+        # Заглушка ждет своей очереди в лимите отправки
+        await asyncio.sleep(0.2)
+        events.append('placeholder')
+        return MessageDelivery(bot_module.bot, chat_id)
+
+    async def generate(*args, **kwargs):
+        events.append('generation')
+        return "рекомендации"
+
+    async def send_recommendations(deliveries, recommendations):
+        events.append(recommendations)
+
+    monkeypatch.setattr(bot_module, 'speculation', None)
+    monkeypatch.setattr(bot_module, 'send_placeholder', slow_placeholder)
+    monkeypatch.setattr(bot_module, 'generate_movie_recommendations', generate)
+    monkeypatch.setattr(bot_module, 'send_recommendations', send_recommendations)
+
+    async def run():
+        await bot_module.db.create_session('GENER1', 2001)
+        await bot_module.db.join_session('GENER1', 2002)
+        await bot_module.generate_and_send_recommendations('GENER1', {}, {})
+
+    asyncio.run(run())
+    assert events == ['generation', 'placeholder', 'placeholder', "рекомендации"]
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from sender import PRIORITY_BULK, SendScheduler, send_priority
+
+API_PORT = 8091
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: запоминает отправленные сообщения и по запросу
+    отвечает 429 с retry_after, как Telegram"""
+
+    def __init__(self):
+        self.sent = []
+        self.limited = {}
+
+    async def handle(self, request):
+        data = await request.post()
+        chat_id, text = int(data['chat_id']), data['text']
+        retry_after = self.limited.pop(text, None)
+        if retry_after is not None:
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after},
+            }, status=429)
+
+        self.sent.append((time.monotonic(), chat_id, text))
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(self.sent),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        }})
+
+
+def run_with_api(scenario, **scheduler_options):
+    """scenario(bot, api) на боте, запросы которого идут через SendScheduler в заглушку"""
+    async def run():
+        api = FakeBotAPI()
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', api.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', API_PORT).start()
+
+        scheduler = SendScheduler(**scheduler_options)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{API_PORT}'))
+        session.middleware(scheduler)
+        bot = Bot('123456:test', session=session)
+        try:
+            return await scenario(bot, api)
+        finally:
+            await scheduler.close()
+            await session.close()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_global_rate_limits_all_chats():
+    async def scenario(bot, api):
+        started_at = time.monotonic()
+        await asyncio.gather(*(bot.send_message(chat_id, 'привет') for chat_id in range(1, 31)))
+        return started_at, api.sent
+
+    started_at, sent = run_with_api(scenario, global_rate=10, chat_rate=100, chat_burst=100)
+    assert len(sent) == 30
+    # Сразу уходит ведро из 10 сообщений, остальные 20 — по 10 в секунду
+    assert sent[-1][0] - started_at >= 1.8
+    assert sum(1 for sent_at, *_ in sent if sent_at - started_at < 0.5) <= 15
+
+
+def test_chat_rate_keeps_order_within_chat():
+    async def scenario(bot, api):
+        started_at = time.monotonic()
+        await asyncio.gather(*(bot.send_message(1, f'сообщение {number}') for number in range(6)))
+        return started_at, api.sent
+
+    started_at, sent = run_with_api(scenario, global_rate=100, chat_rate=5, chat_burst=1)
+    chat_messages = [text for _, chat_id, text in sent if chat_id == 1]
+    assert chat_messages == [f'сообщение {number}' for number in range(6)]
+    # Одно сообщение сразу, остальные пять — по 5 в секунду
+    assert sent[5][0] - started_at >= 0.9
+
+
+def test_other_chats_are_not_blocked_by_chat_limit():
+    async def scenario(bot, api):
+        first_chat = asyncio.gather(*(bot.send_message(1, f'сообщение {number}') for number in range(5)))
+        await asyncio.sleep(0.05)
+        await bot.send_message(2, 'другой чат')
+        other_sent_at = time.monotonic()
+        await first_chat
+        return other_sent_at, api.sent
+
+    other_sent_at, sent = run_with_api(scenario, global_rate=100, chat_rate=2, chat_burst=1)
+    assert other_sent_at < sent[-1][0]
+    assert [chat_id for _, chat_id, _ in sent].index(2) < 4
+
+
+def test_retry_after_requeues_request():
+    async def scenario(bot, api):
+        api.limited['ограничено'] = 1
+        started_at = time.monotonic()
+        message = await bot.send_message(1, 'ограничено')
+        return started_at, message, api.sent
+
+    started_at, message, sent = run_with_api(scenario, global_rate=100, chat_rate=100, chat_burst=100)
+    assert message.text == 'ограничено'
+    assert [text for _, _, text in sent] == ['ограничено']
+    assert sent[0][0] - started_at >= 1
+
+
+def test_interactive_requests_overtake_bulk():
+    async def scenario(bot, api):
+        with send_priority(PRIORITY_BULK):
+            bulk = [asyncio.create_task(bot.send_message(chat_id, 'рассылка')) for chat_id in range(1, 11)]
+        await asyncio.sleep(0.05)
+        await bot.send_message(100, 'ответ пользователю')
+        await asyncio.gather(*bulk)
+        return api.sent
+
+    sent = run_with_api(scenario, global_rate=5, chat_rate=100, chat_burst=100)
+    texts = [text for _, _, text in sent]
+    # Первые 5 рассылочных ушли сразу, ответ — следующим, раньше остальной рассылки
+    assert texts.index('ответ пользователю') == 5
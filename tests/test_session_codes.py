@@ -0,0 +1,43 @@
+import asyncio
+import re
+
+from database import Database, AsyncDatabase
+from session_codes import CodePermutation, SessionCodeAllocator
+
+CODE_FORMAT = re.compile(r'^[A-Z0-9]{6}$')
+
+
+def test_permutation_is_bijection():
+    # Пространство 36^3 проверяется целиком; миллионы кодов — в bench/session_codes_bench.py
+    space = 36 ** 3
+    for key in (b'first key', b'second key'):
+        permutation = CodePermutation(key, space)
+        values = [permutation(number) for number in range(space)]
+        assert sorted(values) == list(range(space))
+    # Разные ключи перемешивают по-разному
+    assert [CodePermutation(b'first key', space)(number) for number in range(10)] != \
+        [CodePermutation(b'second key', space)(number) for number in range(10)]
+
+
+def test_allocators_on_one_db_reserve_disjoint_blocks(tmp_path):
+    async def run():
+        db = AsyncDatabase(Database(str(tmp_path / 'codes.db')))
+        await db.start()
+        blocks = []
+
+        async def reserve(count, secret):
+            first, key = await db.reserve_session_numbers(count, secret)
+            blocks.append(range(first, first + count))
+            return first, key
+
+        # Два аллокатора над одной БД — как два процесса бота
+        allocators = [SessionCodeAllocator(reserve, block_size=7) for _ in range(2)]
+        codes = await asyncio.gather(*(allocators[number % 2].allocate() for number in range(500)))
+        await db.close()
+        return blocks, codes
+
+    blocks, codes = asyncio.run(run())
+    numbers = [number for block in blocks for number in block]
+    assert len(numbers) == len(set(numbers))
+    assert len(set(codes)) == len(codes) == 500
+    assert all(CODE_FORMAT.match(code) for code in codes)
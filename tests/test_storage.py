@@ -0,0 +1,22 @@
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import ActivityTracker
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_tracker_ignores_users_of_other_workers():
+    # Процесс 0 из двух отвечает за четных пользователей
+    tracker = ActivityTracker(owns=lambda user_id: user_id % 2 == 0)
+    long_ago = time.time() - 3600
+
+    tracker.touch(key(2), long_ago)
+    tracker.touch(key(3), long_ago)  # состояние партнера, измененное этим процессом
+    tracker.seed([(key(4), long_ago), (key(5), long_ago)])
+
+    assert len(tracker) == 2
+    assert set(tracker.pop_idle(60)) == {key(2), key(4)}
@@ -0,0 +1,26 @@
+from title_index import TitleIndex
+
+TITLES = [
+    "Гарри Поттер и Тайная комната / Harry Potter and the Chamber of Secrets",
+    "Гарри Поттер и философский камень / Harry Potter and the Sorcerer's Stone",
+    "Ромео и Джульетта / Romeo and Juliet",
+    "Джульетта / Julieta",
+    "Гордость и предубеждение / Pride and Prejudice",
+    "Интерстеллар / Interstellar",
+    "Шрек 2 / Shrek 2",
+    "Комната / Room",
+]
+
+
+def test_conjunction_inside_title_is_not_split():
+    index = TitleIndex(TITLES)
+    assert index.resolve("Гарри Поттер и Тайная комната") == [0]
+    assert index.resolve("Ромео и Джульетта, Pride and Prejudice") == [2, 4]
+    # Опечатка: точного совпадения нет, части по отдельности не находятся
+    assert index.resolve("Гари Поттер и тайная комната") == [0]
+
+
+def test_conjunction_between_titles_is_split():
+    index = TitleIndex(TITLES)
+    assert index.resolve("Интерстеллар и Шрек 2") == [5, 6]
+    assert index.resolve("интерстеллар; шрек 2 и Комната") == [5, 6, 7]